@@ -4,18 +4,37 @@ from .deep_sort import DeepSort
 __all__ = ['DeepSort', 'build_tracker']
 
 
-def build_tracker(cfg, use_cuda):
+def build_tracker(cfg, use_cuda, bgr=False):
     if cfg.USE_FASTREID:
         return DeepSort(model_path=cfg.FASTREID.CHECKPOINT, model_config=cfg.FASTREID.CFG, 
                 max_dist=cfg.DEEPSORT.MAX_DIST, min_confidence=cfg.DEEPSORT.MIN_CONFIDENCE, 
                 nms_max_overlap=cfg.DEEPSORT.NMS_MAX_OVERLAP, max_iou_distance=cfg.DEEPSORT.MAX_IOU_DISTANCE, 
-                max_age=cfg.DEEPSORT.MAX_AGE, n_init=cfg.DEEPSORT.N_INIT, nn_budget=cfg.DEEPSORT.NN_BUDGET, use_cuda=use_cuda)
+                max_age=cfg.DEEPSORT.MAX_AGE, n_init=cfg.DEEPSORT.N_INIT, nn_budget=cfg.DEEPSORT.NN_BUDGET, use_cuda=use_cuda,
+                assignment_solver=cfg.DEEPSORT.get("ASSIGNMENT_SOLVER", "scipy"),
+                decompose_assignment=cfg.DEEPSORT.get("DECOMPOSE_ASSIGNMENT", False),
+                grid_cell_size=cfg.DEEPSORT.get("GRID_CELL_SIZE", 0),
+                lazy_reid=cfg.DEEPSORT.get("LAZY_REID", False),
+                lazy_reid_iou=cfg.DEEPSORT.get("LAZY_REID_IOU", 0.8),
+                reid_refresh_interval=cfg.DEEPSORT.get("REID_REFRESH_INTERVAL", 10),
+                roi_align=cfg.DEEPSORT.get("REID_ROI_ALIGN", False),
+                max_batch_size=cfg.DEEPSORT.get("REID_MAX_BATCH_SIZE", 0),
+                bgr=bgr)
 
     else:
         return DeepSort(model_path=cfg.DEEPSORT.REID_CKPT, 
                 max_dist=cfg.DEEPSORT.MAX_DIST, min_confidence=cfg.DEEPSORT.MIN_CONFIDENCE, 
                 nms_max_overlap=cfg.DEEPSORT.NMS_MAX_OVERLAP, max_iou_distance=cfg.DEEPSORT.MAX_IOU_DISTANCE, 
-                max_age=cfg.DEEPSORT.MAX_AGE, n_init=cfg.DEEPSORT.N_INIT, nn_budget=cfg.DEEPSORT.NN_BUDGET, use_cuda=use_cuda)
+                max_age=cfg.DEEPSORT.MAX_AGE, n_init=cfg.DEEPSORT.N_INIT, nn_budget=cfg.DEEPSORT.NN_BUDGET, use_cuda=use_cuda,
+                assignment_solver=cfg.DEEPSORT.get("ASSIGNMENT_SOLVER", "scipy"),
+                decompose_assignment=cfg.DEEPSORT.get("DECOMPOSE_ASSIGNMENT", False),
+                grid_cell_size=cfg.DEEPSORT.get("GRID_CELL_SIZE", 0),
+                lazy_reid=cfg.DEEPSORT.get("LAZY_REID", False),
+                lazy_reid_iou=cfg.DEEPSORT.get("LAZY_REID_IOU", 0.8),
+                reid_refresh_interval=cfg.DEEPSORT.get("REID_REFRESH_INTERVAL", 10),
+                roi_align=cfg.DEEPSORT.get("REID_ROI_ALIGN", False),
+                max_batch_size=cfg.DEEPSORT.get("REID_MAX_BATCH_SIZE", 0),
+                reid_backend=cfg.DEEPSORT.get("REID_BACKEND", "eager"),
+                bgr=bgr)
     
 
 
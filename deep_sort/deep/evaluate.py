@@ -1,6 +1,11 @@
 import torch
+import argparse
 
-features = torch.load("features.pth")
+parser = argparse.ArgumentParser(description="Evaluate the features written by test.py")
+parser.add_argument("--features",default="features.pth",type=str)
+args = parser.parse_args()
+
+features = torch.load(args.features)
 qf = features["qf"]
 ql = features["ql"]
 gf = features["gf"]
@@ -12,4 +17,12 @@ top1correct = gl[res].eq(ql).sum().item()
 
 print("Acc top1:{:.3f}".format(top1correct/ql.size(0)))
 
+# mean average precision over the full gallery ranking of every query
+order = scores.argsort(dim=1, descending=True)
+matches = gl[order].eq(ql.unsqueeze(1)).float()
+hits = matches.cumsum(dim=1)
+ranks = torch.arange(1, gl.size(0) + 1, dtype=torch.float).unsqueeze(0)
+num_relevant = matches.sum(dim=1)
+ap = (matches * hits / ranks).sum(dim=1) / num_relevant.clamp(min=1)
+print("mAP:{:.3f}".format(ap[num_relevant > 0].mean().item()))
 
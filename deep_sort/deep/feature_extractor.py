@@ -1,56 +1,371 @@
+import os
 import torch
-import torchvision.transforms as transforms
+import inspect
 import numpy as np
 import cv2
+import time
 import logging
+import warnings
+import zlib
+from torchvision.ops import roi_align
 
-from .model import Net
+from .model import Net, load_quantized
+try:
+    import onnxruntime
+except ImportError:  # only needed for the onnx backend
+    onnxruntime = None
+
+# `aligned` arrived in torchvision 0.6, before that the half pixel shift of
+# the boxes is done by hand
+_ROI_ALIGN_ALIGNED = "aligned" in inspect.signature(roi_align).parameters
 # from fastreid.config import get_cfg
 # from fastreid.engine import DefaultTrainer
 # from fastreid.utils.checkpoint import Checkpointer
 
-class Extractor(object):
-    def __init__(self, model_path, use_cuda=True):
-        self.net = Net(reid=True)
-        self.device = "cuda" if torch.cuda.is_available() and use_cuda else "cpu"
-        state_dict = torch.load(model_path, map_location=lambda storage, loc: storage)['net_dict']
-        self.net.load_state_dict(state_dict)
-        logger = logging.getLogger("root.tracker")
-        logger.info("Loading weights from {}... Done!".format(model_path))
-        self.net.to(self.device)
-        self.size = (64, 128)
-        self.norm = transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-        ])
-        
+class BaseExtractor(object):
+    """
+    Shared crop preprocessing and inference of the ReID extractors.
+
+    Crops are resized in uint8 into a preallocated (N, height, width, 3)
+    buffer, which is converted to float, transposed and normalized as one
+    batch on the target device. Subclasses set `self.net`, `self.device` and
+    call `_init_preprocess` with the network's input size.
+
+    Images are RGB, or BGR straight from OpenCV with `bgr`, in which case
+    the channels are swapped on the small resized crops.
+
+    Crops are fed to the network in chunks of at most `max_batch_size` (all
+    at once if None), which bounds the activation memory and latency of
+    crowded frames.
+
+    With `roi_align`, `extract_boxes` skips the per-crop slicing and resizing
+    and samples all boxes from the frame tensor in one
+    `torchvision.ops.roi_align` call instead.
+    """
+    mean = (0.485, 0.456, 0.406)
+    std = (0.229, 0.224, 0.225)
 
+    def _init_preprocess(self, size, roi_align=False, max_batch_size=None, bgr=False):
+        self.size = size
+        self.bgr = bgr
+        self.roi_align = roi_align
+        self.max_batch_size = max_batch_size or None
+        self._buffer = np.zeros((0, size[1], size[0], 3), dtype=np.uint8)
+        self._input = torch.empty((0, 3, size[1], size[0]), device=self.device)
+        # (x / 255 - mean) / std == x * scale - shift
+        std = torch.tensor(self.std).view(1, 3, 1, 1)
+        self._scale = (1. / (255. * std)).to(self.device)
+        self._shift = (torch.tensor(self.mean).view(1, 3, 1, 1) / std).to(self.device)
+
+    def _reserve(self, n):
+        """
+        Grow the input buffers, which are reused across calls, to hold at
+        least n crops but no more than `max_batch_size` unless n demands it.
+        """
+        if n <= len(self._buffer):
+            return
+        capacity = max(n, 2 * len(self._buffer))
+        if self.max_batch_size:
+            capacity = max(n, min(capacity, self.max_batch_size))
+        self._buffer = np.zeros((capacity,) + self._buffer.shape[1:], dtype=np.uint8)
+        self._input = torch.empty((capacity,) + self._input.shape[1:], device=self.device)
+
+    def _chunks(self, n):
+        step = self.max_batch_size or max(n, 1)
+        return [slice(i, min(i + step, n)) for i in range(0, n, step)]
 
     def _preprocess(self, im_crops):
         """
-        TODO:
-            1. to float with scale from 0 to 1
-            2. resize to (64, 128) as Market1501 dataset did
-            3. concatenate to a numpy array
-            3. to torch Tensor
-            4. normalize
+        1. resize to `self.size` (64, 128 as the Market1501 dataset did) in uint8
+        2. stack into one (N, H, W, 3) buffer
+        3. to torch Tensor on the target device, NCHW, float
+        4. scale to [0, 1] and normalize
+
+        The returned tensor is a view of the input buffer and is overwritten
+        by the next call.
+        """
+        n = len(im_crops)
+        self._reserve(n)
+        for im, out in zip(im_crops, self._buffer):
+            cv2.resize(im, self.size, dst=out)
+
+        im_batch = torch.from_numpy(self._buffer[:n]).to(self.device)
+        im_batch = im_batch.permute(0, 3, 1, 2)
+        if self.bgr:
+            im_batch = im_batch.flip(1)
+        im_batch = self._input[:n].copy_(im_batch)
+        return im_batch.mul_(self._scale).sub_(self._shift)
+
+    def _preprocess_boxes(self, ori_img, bbox_xyxy):
+        """
+        1. to torch Tensor on the target device, only the region covered by the boxes
+        2. bilinear resampling of every box to `self.size` with roi_align,
+           sampling pixel centers like cv2.resize does
+        3. scale to [0, 1] and normalize
+
+        Returns one batch per chunk of at most `max_batch_size` boxes.
         """
-        def _resize(im, size):
-            return cv2.resize(im.astype(np.float32)/255., size)
+        height, width = ori_img.shape[:2]
+        x0, y0 = bbox_xyxy[:,:2].min(axis=0)
+        x1 = min(bbox_xyxy[:,2].max() + 1, width)
+        y1 = min(bbox_xyxy[:,3].max() + 1, height)
+        # transposing in numpy and uint8 is cheaper than a strided float tensor
+        region = ori_img[y0:y1, x0:x1, ::-1] if self.bgr else ori_img[y0:y1, x0:x1]
+        region = np.ascontiguousarray(region.transpose(2, 0, 1))
+        region = torch.from_numpy(region).to(self.device).unsqueeze(0).float()
 
-        im_batch = torch.cat([self.norm(_resize(im, self.size)).unsqueeze(0) for im in im_crops], dim=0).float()
-        return im_batch
+        rois = np.zeros((len(bbox_xyxy), 5), dtype=np.float32)
+        rois[:,1:] = bbox_xyxy - [x0, y0, x0, y0]
+        kwargs = {}
+        if _ROI_ALIGN_ALIGNED:
+            kwargs["aligned"] = True
+        else:
+            rois[:,1:] -= 0.5
+        rois = torch.from_numpy(rois).to(self.device)
+        for chunk in self._chunks(len(rois)):
+            im_batch = roi_align(region, rois[chunk], (self.size[1], self.size[0]), spatial_scale=1., sampling_ratio=1, **kwargs)
+            yield im_batch.mul_(self._scale).sub_(self._shift)
 
+    def _run(self, im_batch):
+        return self.net(im_batch).cpu().numpy()
+
+    def _forward(self, im_batches, n):
+        features = None
+        offset = 0
+        with torch.no_grad():
+            for im_batch in im_batches:
+                output = self._run(im_batch)
+                if features is None:
+                    features = np.empty((n,) + output.shape[1:], dtype=output.dtype)
+                features[offset:offset + len(output)] = output
+                offset += len(output)
+        return features if features is not None else np.array([])
 
     def __call__(self, im_crops):
-        im_batch = self._preprocess(im_crops)
+        """
+        Features of a list of HxWx3 uint8 crops, computed in batches of at
+        most `max_batch_size` crops.
+        """
+        im_batches = (self._preprocess(im_crops[chunk]) for chunk in self._chunks(len(im_crops)))
+        return self._forward(im_batches, len(im_crops))
+
+    def extract_boxes(self, ori_img, bbox_xyxy):
+        """
+        Features of the Nx4 integer boxes `bbox_xyxy` (x2 and y2 exclusive,
+        clamped to the frame) of the HxWx3 uint8 image `ori_img`.
+        """
+        bbox_xyxy = np.asarray(bbox_xyxy, dtype=np.int64).reshape(-1, 4)
+        if len(bbox_xyxy) == 0:
+            return np.array([])
+        if not self.roi_align:
+            return self([ori_img[y1:y2, x1:x2] for x1, y1, x2, y2 in bbox_xyxy])
+        return self._forward(self._preprocess_boxes(ori_img, bbox_xyxy), len(bbox_xyxy))
+
+    def extract_frames(self, images, bbox_xyxys):
+        """
+        Features of the boxes of several frames (see `extract_boxes`), with
+        the crops of all frames going through the network together in
+        batches of at most `max_batch_size`. Returns one array per frame.
+        """
+        bbox_xyxys = [np.asarray(b, dtype=np.int64).reshape(-1, 4) for b in bbox_xyxys]
+        counts = [len(b) for b in bbox_xyxys]
+        if not self.roi_align:
+            features = self([im[y1:y2, x1:x2] for im, boxes in zip(images, bbox_xyxys) for x1, y1, x2, y2 in boxes])
+        elif sum(counts) == 0:
+            features = np.array([])
+        else:
+            im_batch = torch.cat([batch for im, boxes in zip(images, bbox_xyxys) if len(boxes) for batch in self._preprocess_boxes(im, boxes)])
+            features = self._forward((im_batch[chunk] for chunk in self._chunks(len(im_batch))), len(im_batch))
+        return np.split(features, np.cumsum(counts)[:-1])
+
+    def tune_max_batch_size(self, batch_sizes=(1, 2, 4, 8, 16, 32, 64, 128), num_crops=None, repeats=3, tolerance=0.05):
+        """
+        Measure the throughput of `__call__` on random crops for every
+        candidate `max_batch_size` on the current machine and keep the
+        smallest size within `tolerance` of the best throughput.
+
+        Returns a dict of batch size -> crops per second.
+        """
+        num_crops = num_crops or max(batch_sizes)
+        rng = np.random.RandomState(0)
+        crops = [rng.randint(0, 256, (rng.randint(64, 256), rng.randint(32, 128), 3)).astype(np.uint8) for _ in range(num_crops)]
+        throughput = {}
+        for batch_size in batch_sizes:
+            self.max_batch_size = batch_size
+            self(crops[:batch_size])
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                self(crops)
+                if self.device != "cpu":
+                    torch.cuda.synchronize()
+                times.append(time.perf_counter() - start)
+            throughput[batch_size] = num_crops / np.median(times)
+        best = max(throughput.values())
+        self.max_batch_size = min(b for b, t in throughput.items() if t >= (1 - tolerance) * best)
+        return throughput
+
+
+def checkpoint_checksum(model_path):
+    """
+    CRC-32 of the checkpoint file combined with the torch version, which keys
+    the compiled artifacts derived from the checkpoint. CRC-32 is enough to
+    notice a changed checkpoint and twice as fast as SHA-1, which matters
+    for the cold start.
+    """
+    crc = zlib.crc32(torch.__version__.encode())
+    with open(model_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 22), b""):
+            crc = zlib.crc32(block, crc)
+    return "{:08x}".format(crc)
+
+
+def artifact_path(model_path, suffix):
+    return "{}.{}.{}".format(model_path, checkpoint_checksum(model_path), suffix)
+
+
+def load_net(model_path, device="cpu"):
+    """
+    Build `Net(reid=True)` in eval mode with the weights of the checkpoint.
+    """
+    net = Net(reid=True)
+    state_dict = torch.load(model_path, map_location=lambda storage, loc: storage)['net_dict']
+    net.load_state_dict(state_dict)
+    net.to(device)
+    net.eval()
+    return net
+
+
+def export_onnx(model_path, onnx_path, opset_version=11):
+    """
+    Export the `Net(reid=True)` checkpoint `model_path` to ONNX with a
+    dynamic batch axis. The graph takes a normalized (N, 3, 128, 64) float
+    batch named "input" and returns (N, 512) features named "features".
+    The default opset is the newest one the pinned torch 1.4 can export.
+    """
+    net = load_net(model_path)
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript based exporter supports dynamic_axes without onnxscript
+        kwargs["dynamo"] = False
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)
+        torch.onnx.export(
+            net, torch.zeros((2, 3, 128, 64)), onnx_path,
+            input_names=["input"], output_names=["features"],
+            dynamic_axes={"input": {0: "batch"}, "features": {0: "batch"}},
+            opset_version=opset_version, **kwargs)
+    return onnx_path
+
+
+class Extractor(BaseExtractor):
+    """
+    Extractor of the `Net` ReID model of this repository.
+
+    `backend` selects how the network runs: "eager" builds `Net` and loads
+    the checkpoint, "torchscript" traces `Net(reid=True)` once, freezes it
+    (which folds BatchNorm into the convolutions) and saves the artifact next
+    to the checkpoint as `<checkpoint>.<checksum>.<device>.ts`. Later runs
+    load the artifact directly as long as the checkpoint is unchanged, and
+    optimize it for inference on the current device. "quantized" loads an
+    INT8 checkpoint written by `model.save_quantized` and runs on the CPU.
+    """
+    backends = ("eager", "torchscript", "quantized")
+
+    def __init__(self, model_path, use_cuda=True, roi_align=False, max_batch_size=None, backend="eager", bgr=False):
+        if backend not in self.backends:
+            raise ValueError("Unknown ReID backend {}, expected one of {}".format(backend, self.backends))
+        self.device = "cuda" if torch.cuda.is_available() and use_cuda and backend != "quantized" else "cpu"
+        self.backend = backend
+        logger = logging.getLogger("root.tracker")
+        if backend == "torchscript":
+            self.net = self._load_torchscript(model_path)
+        elif backend == "quantized":
+            self.net = load_quantized(model_path)
+        else:
+            self.net = self._load_eager(model_path)
+        logger.info("Loading weights from {}... Done!".format(model_path))
+        self._init_preprocess((64, 128), roi_align, max_batch_size, bgr)
+
+    def _load_eager(self, model_path):
+        return load_net(model_path, self.device)
+
+    def _load_torchscript(self, model_path):
+        logger = logging.getLogger("root.tracker")
+        path = artifact_path(model_path, "{}.ts".format(self.device))
+        with warnings.catch_warnings():
+            # torch.jit is deprecated in favour of torch.export, but still the
+            # only way to serialize a frozen module
+            warnings.simplefilter("ignore", FutureWarning)
+            if os.path.isfile(path):
+                logger.info("Loading TorchScript artifact {}".format(path))
+                net = torch.jit.load(path, map_location=self.device)
+            else:
+                net = self._compile_torchscript(model_path, path)
+            # the device specific rewrites (e.g. MKLDNN convolutions on CPU)
+            # cannot be serialized and are applied on every load, where torch
+            # has them (>= 1.9)
+            if hasattr(torch.jit, "optimize_for_inference"):
+                net = torch.jit.optimize_for_inference(net)
+            return net
+
+    def _compile_torchscript(self, model_path, path):
+        logger = logging.getLogger("root.tracker")
+        net = self._load_eager(model_path)
+        example = torch.zeros((2, 3, 128, 64), device=self.device)
         with torch.no_grad():
-            im_batch = im_batch.to(self.device)
-            features = self.net(im_batch)
-        return features.cpu().numpy()
+            net = torch.jit.trace(net, example)
+            # inline the weights as constants (torch >= 1.8)
+            if hasattr(torch.jit, "freeze"):
+                net = torch.jit.freeze(net)
+        try:
+            torch.jit.save(net, path + ".tmp")
+            os.replace(path + ".tmp", path)
+            logger.info("Saved TorchScript artifact {}".format(path))
+        except OSError as e:
+            logger.warning("Could not save TorchScript artifact {}: {}".format(path, e))
+        return net
+
+
+class OnnxExtractor(BaseExtractor):
+    """
+    Extractor running the `Net` ReID model with ONNX Runtime, which is
+    considerably faster than eager PyTorch on CPU.
+
+    `model_path` is either an exported .onnx model or a `Net` checkpoint,
+    which is exported once to `<checkpoint>.<checksum>.onnx` next to it.
+    Preprocessing runs in PyTorch on the CPU.
+    """
+    def __init__(self, model_path, use_cuda=True, roi_align=False, max_batch_size=None, bgr=False):
+        if onnxruntime is None:
+            raise ValueError("The 'onnx' ReID backend requires the onnxruntime package")
+        logger = logging.getLogger("root.tracker")
+        if not model_path.endswith(".onnx"):
+            onnx_path = artifact_path(model_path, "onnx")
+            if not os.path.isfile(onnx_path):
+                export_onnx(model_path, onnx_path + ".tmp")
+                os.replace(onnx_path + ".tmp", onnx_path)
+                logger.info("Exported ONNX model {}".format(onnx_path))
+            model_path = onnx_path
+
+        providers = ["CPUExecutionProvider"]
+        if use_cuda and "CUDAExecutionProvider" in onnxruntime.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.net = onnxruntime.InferenceSession(model_path, options, providers=providers)
+        self.input_name = self.net.get_inputs()[0].name
+        self.device = "cpu"
+        logger.info("Loading weights from {}... Done!".format(model_path))
+        height, width = self.net.get_inputs()[0].shape[2:]
+        self._init_preprocess((width, height), roi_align, max_batch_size, bgr)
+
+    def _run(self, im_batch):
+        return self.net.run(None, {self.input_name: im_batch.numpy()})[0]
 
-class FastReIDExtractor(object):
-    def __init__(self, model_config, model_path, use_cuda=True):
+
+class FastReIDExtractor(BaseExtractor):
+    def __init__(self, model_config, model_path, use_cuda=True, roi_align=False, max_batch_size=None, bgr=False):
         cfg = get_cfg()
         cfg.merge_from_file(model_config)
         cfg.MODEL.BACKBONE.PRETRAIN = False
@@ -63,27 +378,7 @@ class FastReIDExtractor(object):
         self.net.to(self.device)
         self.net.eval()
         height, width = cfg.INPUT.SIZE_TEST
-        self.size = (width, height)
-        self.norm = transforms.Compose([
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-        ])
-
-    
-    def _preprocess(self, im_crops):
-        def _resize(im, size):
-            return cv2.resize(im.astype(np.float32)/255., size)
-
-        im_batch = torch.cat([self.norm(_resize(im, self.size)).unsqueeze(0) for im in im_crops], dim=0).float()
-        return im_batch
-
-
-    def __call__(self, im_crops):
-        im_batch = self._preprocess(im_crops)
-        with torch.no_grad():
-            im_batch = im_batch.to(self.device)
-            features = self.net(im_batch)
-        return features.cpu().numpy()
+        self._init_preprocess((width, height), roi_align, max_batch_size, bgr)
 
 
 
@@ -1,6 +1,8 @@
+import inspect
+import warnings
 import torch
 import torch.nn as nn
-import torch.nn.functional as F
+from torch import quantization
 
 class BasicBlock(nn.Module):
     def __init__(self, c_in, c_out,is_downsample=False):
@@ -25,6 +27,8 @@ class BasicBlock(nn.Module):
                 nn.BatchNorm2d(c_out)
             )
             self.is_downsample = True
+        # the residual add + relu as a module, so that it can be quantized
+        self.skip_add = nn.quantized.FloatFunctional()
 
     def forward(self,x):
         y = self.conv1(x)
@@ -34,7 +38,12 @@ class BasicBlock(nn.Module):
         y = self.bn2(y)
         if self.is_downsample:
             x = self.downsample(x)
-        return F.relu(x.add(y),True)
+        return self.skip_add.add_relu(x, y)
+
+    def fuse_model(self):
+        quantization.fuse_modules(self, [['conv1', 'bn1', 'relu'], ['conv2', 'bn2']], inplace=True)
+        if self.is_downsample:
+            quantization.fuse_modules(self.downsample, [['0', '1']], inplace=True)
 
 def make_layers(c_in,c_out,repeat_times, is_downsample=False):
     blocks = []
@@ -77,8 +86,12 @@ class Net(nn.Module):
             nn.Dropout(),
             nn.Linear(256, num_classes),
         )
+        # identities until the model is quantized, see `quantize_net`
+        self.quant = quantization.QuantStub()
+        self.dequant = quantization.DeQuantStub()
     
     def forward(self, x):
+        x = self.quant(x)
         x = self.conv(x)
         x = self.layer1(x)
         x = self.layer2(x)
@@ -86,6 +99,7 @@ class Net(nn.Module):
         x = self.layer4(x)
         x = self.avgpool(x)
         x = x.view(x.size(0),-1)
+        x = self.dequant(x)
         # B x 128
         if self.reid:
             x = x.div(x.norm(p=2,dim=1,keepdim=True))
@@ -94,6 +108,71 @@ class Net(nn.Module):
         x = self.classifier(x)
         return x
 
+    def fuse_model(self):
+        """
+        Fuse conv+bn(+relu) in place, the model must be in eval mode.
+        """
+        quantization.fuse_modules(self.conv, [['0', '1', '2']], inplace=True)
+        for layer in (self.layer1, self.layer2, self.layer3, self.layer4):
+            for block in layer:
+                block.fuse_model()
+
+
+def default_qengine():
+    engines = torch.backends.quantized.supported_engines
+    return 'fbgemm' if 'fbgemm' in engines else 'qnnpack'
+
+
+def prepare_quantization(net, qengine=None):
+    """
+    Fuse a float `Net(reid=True)` and insert observers for static
+    post-training quantization with `qengine` (fbgemm on x86, qnnpack on
+    ARM). The classifier is not used for ReID and stays in float.
+    """
+    qengine = qengine or default_qengine()
+    torch.backends.quantized.engine = qengine
+    net.eval()
+    net.fuse_model()
+    net.qconfig = quantization.get_default_qconfig(qengine)
+    net.classifier.qconfig = None
+    return quantization.prepare(net, inplace=True)
+
+
+def quantize_net(net, batches, qengine=None):
+    """
+    Quantize a float `Net(reid=True)` to INT8, calibrating the activation
+    ranges on the normalized (N, 3, 128, 64) tensors of `batches`.
+    """
+    net = prepare_quantization(net, qengine)
+    with torch.no_grad():
+        for batch in batches:
+            net(batch)
+    return quantization.convert(net, inplace=True)
+
+
+def save_quantized(net, path):
+    torch.save({'net_dict': net.state_dict(), 'qengine': torch.backends.quantized.engine}, path)
+
+
+def load_quantized(path):
+    """
+    Load a checkpoint written by `save_quantized` into a quantized
+    `Net(reid=True)`, which runs on the CPU only.
+    """
+    # the packed quantized weights need the full unpickler, which torch
+    # >= 1.13 only allows with weights_only=False (older ones have no choice)
+    kwargs = {}
+    if 'weights_only' in inspect.signature(torch.load).parameters:
+        kwargs['weights_only'] = False
+    checkpoint = torch.load(path, map_location='cpu', **kwargs)
+    with warnings.catch_warnings():
+        # the observers of the skeleton never ran, its qparams are overwritten
+        warnings.simplefilter('ignore')
+        net = prepare_quantization(Net(reid=True), checkpoint['qengine'])
+        net = quantization.convert(net, inplace=True)
+    net.load_state_dict(checkpoint['net_dict'])
+    return net
+
 
 if __name__ == '__main__':
     net = Net()
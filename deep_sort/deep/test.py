@@ -5,17 +5,20 @@ import torchvision
 import argparse
 import os
 
-from model import Net
+from model import Net, load_quantized
 
 parser = argparse.ArgumentParser(description="Train on market1501")
 parser.add_argument("--data-dir",default='data',type=str)
 parser.add_argument("--no-cuda",action="store_true")
 parser.add_argument("--gpu-id",default=0,type=int)
+parser.add_argument("--quantized",default="",type=str,help="evaluate this INT8 checkpoint (CPU only) instead of checkpoint/ckpt.t7")
+parser.add_argument("--output",default="features.pth",type=str)
 args = parser.parse_args()
 
 # device
-device = "cuda:{}".format(args.gpu_id) if torch.cuda.is_available() and not args.no_cuda else "cpu"
-if torch.cuda.is_available() and not args.no_cuda:
+use_cuda = torch.cuda.is_available() and not args.no_cuda and not args.quantized
+device = "cuda:{}".format(args.gpu_id) if use_cuda else "cpu"
+if use_cuda:
     cudnn.benchmark = True
 
 # data loader
@@ -37,14 +40,19 @@ galleryloader = torch.utils.data.DataLoader(
 )
 
 # net definition
-net = Net(reid=True)
-assert os.path.isfile("./checkpoint/ckpt.t7"), "Error: no checkpoint file found!"
-print('Loading from checkpoint/ckpt.t7')
-checkpoint = torch.load("./checkpoint/ckpt.t7")
-net_dict = checkpoint['net_dict']
-net.load_state_dict(net_dict, strict=False)
-net.eval()
-net.to(device)
+if args.quantized:
+    assert os.path.isfile(args.quantized), "Error: no quantized checkpoint file found!"
+    print('Loading from {}'.format(args.quantized))
+    net = load_quantized(args.quantized)
+else:
+    net = Net(reid=True)
+    assert os.path.isfile("./checkpoint/ckpt.t7"), "Error: no checkpoint file found!"
+    print('Loading from checkpoint/ckpt.t7')
+    checkpoint = torch.load("./checkpoint/ckpt.t7")
+    net_dict = checkpoint['net_dict']
+    net.load_state_dict(net_dict, strict=False)
+    net.eval()
+    net.to(device)
 
 # compute features
 query_features = torch.tensor([]).float()
@@ -74,4 +82,4 @@ features = {
     "gf": gallery_features,
     "gl": gallery_labels
 }
-torch.save(features,"features.pth")
\ No newline at end of file
+torch.save(features,args.output)
\ No newline at end of file
@@ -1,7 +1,8 @@
 import numpy as np
 import torch
+from concurrent.futures import Future, ThreadPoolExecutor
 
-from .deep.feature_extractor import Extractor, FastReIDExtractor
+from .deep.feature_extractor import Extractor, FastReIDExtractor, OnnxExtractor
 from .sort.nn_matching import NearestNeighborDistanceMetric
 from .sort.preprocessing import non_max_suppression
 from .sort.detection import Detection
@@ -12,47 +13,152 @@ __all__ = ['DeepSort']
 
 
 class DeepSort(object):
-    def __init__(self, model_path, model_config=None, max_dist=0.2, min_confidence=0.3, nms_max_overlap=1.0, max_iou_distance=0.7, max_age=70, n_init=3, nn_budget=100, use_cuda=True):
+    def __init__(self, model_path, model_config=None, max_dist=0.2, min_confidence=0.3, nms_max_overlap=1.0, max_iou_distance=0.7, max_age=70, n_init=3, nn_budget=100, use_cuda=True, assignment_solver="scipy", grid_cell_size=None, lazy_reid=False, lazy_reid_iou=0.8, reid_refresh_interval=10, roi_align=False, max_batch_size=None, reid_backend="eager", bgr=False, decompose_assignment=False):
         self.min_confidence = min_confidence
         self.nms_max_overlap = nms_max_overlap
 
-        if model_config is None:
-            self.extractor = Extractor(model_path, use_cuda=use_cuda)
+        if model_config is None and reid_backend == "onnx":
+            self.extractor = OnnxExtractor(model_path, use_cuda=use_cuda, roi_align=roi_align, max_batch_size=max_batch_size, bgr=bgr)
+        elif model_config is None:
+            self.extractor = Extractor(model_path, use_cuda=use_cuda, roi_align=roi_align, max_batch_size=max_batch_size, backend=reid_backend, bgr=bgr)
         else:
-            self.extractor = FastReIDExtractor(model_config, model_path, use_cuda=use_cuda)
+            self.extractor = FastReIDExtractor(model_config, model_path, use_cuda=use_cuda, roi_align=roi_align, max_batch_size=max_batch_size, bgr=bgr)
 
         max_cosine_distance = max_dist
         metric = NearestNeighborDistanceMetric("cosine", max_cosine_distance, nn_budget)
-        self.tracker = Tracker(metric, max_iou_distance=max_iou_distance, max_age=max_age, n_init=n_init)
+        self.tracker = Tracker(metric, max_iou_distance=max_iou_distance, max_age=max_age, n_init=n_init, assignment_solver=assignment_solver, grid_cell_size=grid_cell_size,
+                               lazy_iou=lazy_reid_iou if lazy_reid else None, feature_refresh_interval=reid_refresh_interval,
+                               decompose_assignment=decompose_assignment)
+        # counters of the last update, including the tracker's
+        self.stats = {}
+        # frame id -> (submitted box indices, future of their features)
+        self._pending = {}
+        self._executor = None
+        self._last_frame_id = None
+
+    def _select(self, bbox_tlwh, confidences):
+        """
+        Indices of the boxes that pass the confidence filter and non-maximum
+        suppression, the only ones that go through the feature extractor.
+        """
+        scores = np.asarray(confidences, dtype=np.float64).reshape(-1)
+        candidates = np.flatnonzero(scores > self.min_confidence)
+        boxes = np.asarray(bbox_tlwh, dtype=np.float64).reshape(-1, 4)[candidates]
+        keep = non_max_suppression(boxes, self.nms_max_overlap, scores[candidates])
+        return candidates[np.asarray(keep, dtype=np.int64)]
+
+    def submit_features(self, frame_id, bbox_xywh, ori_img, confidences=None):
+        """
+        Start the ReID forward of the boxes of frame `frame_id` on a worker
+        thread and return a future of their features, so that it overlaps
+        with the detector of the next frame. `update` with the same
+        `frame_id` consumes it. With `confidences`, only the boxes that
+        survive the confidence filter and NMS are embedded, in the order of
+        `_select`. Frames must be updated in order; `ori_img` must not be
+        modified until then.
+        """
+        if self._executor is None:
+            # a single worker keeps the forwards in order and the extractor's
+            # buffers private to one thread
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reid")
+        if confidences is None:
+            indices = np.arange(len(bbox_xywh))
+        else:
+            indices = self._select(self._xywh_to_tlwh(bbox_xywh), confidences)
+        self.height, self.width = ori_img.shape[:2]
+        bbox_xyxy = self._xywh_to_xyxy_batch(bbox_xywh[indices])
+        future = self._executor.submit(self.extractor.extract_boxes, ori_img, bbox_xyxy)
+        self._pending[frame_id] = (indices, future)
+        return future
+
+    def precompute_features(self, frame_ids, bbox_xywhs, ori_imgs, confidences=None):
+        """
+        Lookahead batching for offline processing: embed the boxes of a
+        window of frames in a few large batches instead of one small batch
+        per frame. `update` with the same frame ids then consumes the
+        features frame by frame, as for `submit_features`. With
+        `confidences`, one per frame, only the boxes that survive the
+        confidence filter and NMS are embedded.
+        """
+        indices, bbox_xyxys = [], []
+        for k, (bbox_xywh, ori_img) in enumerate(zip(bbox_xywhs, ori_imgs)):
+            if confidences is None:
+                indices.append(np.arange(len(bbox_xywh)))
+            else:
+                indices.append(self._select(self._xywh_to_tlwh(bbox_xywh), confidences[k]))
+            self.height, self.width = ori_img.shape[:2]
+            bbox_xyxys.append(self._xywh_to_xyxy_batch(bbox_xywh[indices[-1]]))
+
+        if self._executor is None:
+            features = self.extractor.extract_frames(ori_imgs, bbox_xyxys)
+        else:
+            features = self._executor.submit(self.extractor.extract_frames, ori_imgs, bbox_xyxys).result()
+        for frame_id, frame_indices, frame_features in zip(frame_ids, indices, features):
+            future = Future()
+            future.set_result(frame_features)
+            self._pending[frame_id] = (frame_indices, future)
 
-    def update(self, bbox_xywh, confidences, ori_img):
+    def _consume_features(self, frame_id, bbox_xywh, indices, ori_img):
+        """
+        Features of the boxes `indices` of the current frame, from the future
+        submitted for `frame_id` if there is one, and the number of crops
+        that went through the extractor.
+        """
+        if frame_id is not None:
+            if self._last_frame_id is not None and frame_id <= self._last_frame_id:
+                raise ValueError("Frame {} updated after frame {}".format(frame_id, self._last_frame_id))
+            self._last_frame_id = frame_id
+            # submitted frames that were never updated
+            for stale in [f for f in self._pending if f < frame_id]:
+                self._pending.pop(stale)[1].cancel()
+        if frame_id not in self._pending:
+            if self._executor is None:
+                return self._get_features(bbox_xywh[indices], ori_img), len(indices)
+            future = self._executor.submit(self._get_features, bbox_xywh[indices], ori_img)
+            return future.result(), len(indices)
+
+        submitted, future = self._pending.pop(frame_id)
+        features = future.result()
+        if len(indices) == 0:
+            return features[:0], len(submitted)
+        position = np.full(len(bbox_xywh), -1, dtype=np.int64)
+        position[submitted] = np.arange(len(submitted))
+        rows = position[indices]
+        if np.any(rows < 0):
+            raise ValueError("Boxes of frame {} were not submitted".format(frame_id))
+        return features[rows], len(submitted)
+
+    def update(self, bbox_xywh, confidences, ori_img, frame_id=None):
         self.height, self.width = ori_img.shape[:2]
-        # generate detections
-        features = self._get_features(bbox_xywh, ori_img)
+        # filter by confidence and run non-maximum supression first, so that
+        # only the surviving boxes go through the feature extractor
         bbox_tlwh = self._xywh_to_tlwh(bbox_xywh)
-        detections = [Detection(bbox_tlwh[i], conf, features[i]) for i,conf in enumerate(confidences) if conf>self.min_confidence]
+        indices = self._select(bbox_tlwh, confidences)
 
-        # run on non-maximum supression
-        boxes = np.array([d.tlwh for d in detections])
-        scores = np.array([d.confidence for d in detections])
-        indices = non_max_suppression(boxes, self.nms_max_overlap, scores)
-        detections = [detections[i] for i in indices]
+        detections = [Detection(bbox_tlwh[i], confidences[i], None) for i in indices]
 
-        # update tracker
+        # in lazy mode, unambiguous associations are made without appearance
+        # and their detections are not embedded
         self.tracker.predict()
-        self.tracker.update(detections)
+        prematched = self.tracker.preassociate(detections)
+        embed = np.setdiff1d(np.arange(len(detections)), prematched[:,1])
+
+        # generate features, or collect those of `submit_features`
+        features, forwards = self._consume_features(frame_id, bbox_xywh, indices[embed], ori_img)
+        for k,j in enumerate(embed):
+            detections[j].feature = features[k]
+
+        # update tracker
+        self.tracker.update(detections, prematched)
+        self.stats = dict(self.tracker.stats, reid_forwards=forwards, reid_forwards_saved=len(confidences) - forwards)
 
         # output bbox identities
-        outputs = []
-        for track in self.tracker.tracks:
-            if not track.is_confirmed() or track.time_since_update > 1:
-                continue
-            box = track.to_tlwh()
-            x1,y1,x2,y2 = self._tlwh_to_xyxy(box)
-            track_id = track.track_id
-            outputs.append(np.array([x1,y1,x2,y2,track_id], dtype=np.int))
-        if len(outputs) > 0:
-            outputs = np.stack(outputs,axis=0)
+        table = self.tracker.table
+        rows = np.flatnonzero(table.is_confirmed() & (table.time_since_update <= 1))
+        if len(rows) == 0:
+            return []
+        bbox_xyxy = self._tlwh_to_xyxy_batch(table.to_tlwh(rows))
+        outputs = np.concatenate([bbox_xyxy, table.track_id[rows, None]], axis=1)
         return outputs
 
 
@@ -80,6 +186,17 @@ class DeepSort(object):
         y2 = min(int(y+h/2),self.height-1)
         return x1,y1,x2,y2
 
+    def _xywh_to_xyxy_batch(self, bbox_xywh):
+        """
+        Vectorized `_xywh_to_xyxy` for an Nx4 array of boxes.
+        """
+        bbox_xywh = np.asarray(bbox_xywh, dtype=np.float64).reshape(-1, 4)
+        x1 = np.maximum((bbox_xywh[:,0] - bbox_xywh[:,2]/2).astype(int), 0)
+        x2 = np.minimum((bbox_xywh[:,0] + bbox_xywh[:,2]/2).astype(int), self.width-1)
+        y1 = np.maximum((bbox_xywh[:,1] - bbox_xywh[:,3]/2).astype(int), 0)
+        y2 = np.minimum((bbox_xywh[:,1] + bbox_xywh[:,3]/2).astype(int), self.height-1)
+        return np.stack([x1,y1,x2,y2], axis=1)
+
     def _tlwh_to_xyxy(self, bbox_tlwh):
         """
         TODO:
@@ -93,6 +210,16 @@ class DeepSort(object):
         y2 = min(int(y+h),self.height-1)
         return x1,y1,x2,y2
 
+    def _tlwh_to_xyxy_batch(self, bbox_tlwh):
+        """
+        Vectorized `_tlwh_to_xyxy` for an Nx4 array of boxes.
+        """
+        x1 = np.maximum(bbox_tlwh[:,0].astype(int), 0)
+        x2 = np.minimum((bbox_tlwh[:,0] + bbox_tlwh[:,2]).astype(int), self.width-1)
+        y1 = np.maximum(bbox_tlwh[:,1].astype(int), 0)
+        y2 = np.minimum((bbox_tlwh[:,1] + bbox_tlwh[:,3]).astype(int), self.height-1)
+        return np.stack([x1,y1,x2,y2], axis=1)
+
     def _xyxy_to_tlwh(self, bbox_xyxy):
         x1,y1,x2,y2 = bbox_xyxy
 
@@ -103,15 +230,6 @@ class DeepSort(object):
         return t,l,w,h
     
     def _get_features(self, bbox_xywh, ori_img):
-        im_crops = []
-        for box in bbox_xywh:
-            x1,y1,x2,y2 = self._xywh_to_xyxy(box)
-            im = ori_img[y1:y2,x1:x2]
-            im_crops.append(im)
-        if im_crops:
-            features = self.extractor(im_crops)
-        else:
-            features = np.array([])
-        return features
+        return self.extractor.extract_boxes(ori_img, self._xywh_to_xyxy_batch(bbox_xywh))
 
 
@@ -12,8 +12,9 @@ class Detection(object):
         Bounding box in format `(x, y, w, h)`.
     confidence : float
         Detector confidence score.
-    feature : array_like
-        A feature vector that describes the object contained in this image.
+    feature : array_like | NoneType
+        A feature vector that describes the object contained in this image, or
+        None if the detection was not embedded.
 
     Attributes
     ----------
@@ -27,9 +28,10 @@ class Detection(object):
     """
 
     def __init__(self, tlwh, confidence, feature):
-        self.tlwh = np.asarray(tlwh, dtype=np.float)
+        self.tlwh = np.asarray(tlwh, dtype=np.float64)
         self.confidence = float(confidence)
-        self.feature = np.asarray(feature, dtype=np.float32)
+        self.feature = None if feature is None else \
+            np.asarray(feature, dtype=np.float32)
 
     def to_tlbr(self):
         """Convert bounding box to format `(min x, min y, max x, max y)`, i.e.,
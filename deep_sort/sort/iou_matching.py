@@ -39,14 +39,53 @@ def iou(bbox, candidates):
     return area_intersection / (area_bbox + area_candidates - area_intersection)
 
 
+def iou_matrix(bboxes, candidates):
+    """Computer pair-wise intersection over union.
+
+    Parameters
+    ----------
+    bboxes : ndarray
+        A matrix of N bounding boxes (one per row) in format `(top left x, top
+        left y, width, height)`.
+    candidates : ndarray
+        A matrix of M candidate bounding boxes (one per row) in the same format
+        as `bboxes`.
+
+    Returns
+    -------
+    ndarray
+        Returns a matrix of shape N, M where entry (i, j) is the intersection
+        over union in [0, 1] between `bboxes[i]` and `candidates[j]`, i.e.,
+        row i equals `iou(bboxes[i], candidates)`.
+
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    candidates = np.asarray(candidates, dtype=np.float64).reshape(-1, 4)
+    bboxes_tl = bboxes[:, np.newaxis, :2]
+    bboxes_br = bboxes[:, np.newaxis, :2] + bboxes[:, np.newaxis, 2:]
+    candidates_tl = candidates[np.newaxis, :, :2]
+    candidates_br = candidates[np.newaxis, :, :2] + candidates[np.newaxis, :, 2:]
+
+    tl = np.maximum(bboxes_tl, candidates_tl)
+    br = np.minimum(bboxes_br, candidates_br)
+    wh = np.maximum(0., br - tl)
+
+    area_intersection = wh.prod(axis=2)
+    area_bboxes = bboxes[:, 2:].prod(axis=1)
+    area_candidates = candidates[:, 2:].prod(axis=1)
+    return area_intersection / (
+        area_bboxes[:, np.newaxis] + area_candidates[np.newaxis, :] -
+        area_intersection)
+
+
 def iou_cost(tracks, detections, track_indices=None,
              detection_indices=None):
     """An intersection over union distance metric.
 
     Parameters
     ----------
-    tracks : List[deep_sort.track.Track]
-        A list of tracks.
+    tracks : deep_sort.track.TrackTable
+        The predicted tracks at the current time step.
     detections : List[deep_sort.detection.Detection]
         A list of detections.
     track_indices : Optional[List[int]]
@@ -68,14 +107,10 @@ def iou_cost(tracks, detections, track_indices=None,
         track_indices = np.arange(len(tracks))
     if detection_indices is None:
         detection_indices = np.arange(len(detections))
+    track_indices = np.asarray(track_indices, dtype=np.int64)
 
-    cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
-    for row, track_idx in enumerate(track_indices):
-        if tracks[track_idx].time_since_update > 1:
-            cost_matrix[row, :] = linear_assignment.INFTY_COST
-            continue
-
-        bbox = tracks[track_idx].to_tlwh()
-        candidates = np.asarray([detections[i].tlwh for i in detection_indices])
-        cost_matrix[row, :] = 1. - iou(bbox, candidates)
+    candidates = np.asarray([detections[i].tlwh for i in detection_indices])
+    cost_matrix = 1. - iou_matrix(tracks.to_tlwh(track_indices), candidates)
+    cost_matrix[tracks.time_since_update[track_indices] > 1, :] = \
+        linear_assignment.INFTY_COST
     return cost_matrix
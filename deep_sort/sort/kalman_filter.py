@@ -185,6 +185,116 @@ class KalmanFilter(object):
             kalman_gain, projected_cov, kalman_gain.T))
         return new_mean, new_covariance
 
+    def _motion_covariance_batch(self, mean):
+        """Stacked process noise for `predict_batch`, one 8x8 block per row of
+        `mean`.
+        """
+        height = mean[:, 3]
+        std = np.empty_like(mean)
+        std[:, 0] = std[:, 1] = std[:, 3] = \
+            self._std_weight_position * height
+        std[:, 2] = 1e-2
+        std[:, 4] = std[:, 5] = std[:, 7] = \
+            self._std_weight_velocity * height
+        std[:, 6] = 1e-5
+        motion_cov = np.zeros(mean.shape + mean.shape[-1:])
+        diag = np.arange(mean.shape[1])
+        motion_cov[:, diag, diag] = np.square(std)
+        return motion_cov
+
+    def predict_batch(self, mean, covariance):
+        """Run Kalman filter prediction step for N states at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of object state mean vectors at the
+            previous time step.
+        covariance : ndarray
+            The Nx8x8 dimensional array of object state covariance matrices at
+            the previous time step.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx8 mean matrix and Nx8x8 covariance array of the
+            predicted states. Row i is equal to `predict(mean[i],
+            covariance[i])` up to floating point round-off.
+
+        """
+        motion_cov = self._motion_covariance_batch(mean)
+
+        mean = np.dot(mean, self._motion_mat.T)
+        covariance = np.matmul(np.matmul(
+            self._motion_mat, covariance), self._motion_mat.T) + motion_cov
+
+        return mean, covariance
+
+    def project_batch(self, mean, covariance):
+        """Project N state distributions to measurement space.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional array of state covariance matrices.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 projected covariance
+            matrices of the given state estimates.
+
+        """
+        std = np.empty((len(mean), 4))
+        std[:, 0] = std[:, 1] = std[:, 3] = \
+            self._std_weight_position * mean[:, 3]
+        std[:, 2] = 1e-1
+        innovation_cov = np.zeros((len(mean), 4, 4))
+        diag = np.arange(4)
+        innovation_cov[:, diag, diag] = np.square(std)
+
+        mean = np.dot(mean, self._update_mat.T)
+        covariance = np.matmul(np.matmul(
+            self._update_mat, covariance), self._update_mat.T)
+        return mean, covariance + innovation_cov
+
+    def update_batch(self, mean, covariance, measurement):
+        """Run Kalman filter correction step for N states at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of predicted state mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional array of state covariance matrices.
+        measurement : ndarray
+            The Nx4 dimensional matrix of measurement vectors (x, y, a, h),
+            where row i is associated with state i.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions.
+
+        """
+        projected_mean, projected_cov = self.project_batch(mean, covariance)
+
+        # The innovation covariances are symmetric positive definite, so the
+        # stacked solve below is equivalent to the Cholesky solve in `update`.
+        kalman_gain = np.linalg.solve(
+            projected_cov,
+            np.matmul(covariance, self._update_mat.T).transpose(0, 2, 1)
+        ).transpose(0, 2, 1)
+        innovation = measurement - projected_mean
+
+        new_mean = mean + np.matmul(
+            kalman_gain, innovation[:, :, np.newaxis])[:, :, 0]
+        new_covariance = covariance - np.matmul(np.matmul(
+            kalman_gain, projected_cov), kalman_gain.transpose(0, 2, 1))
+        return new_mean, new_covariance
+
     def gating_distance(self, mean, covariance, measurements,
                         only_position=False):
         """Compute gating distance between state distribution and measurements.
@@ -227,3 +337,132 @@ class KalmanFilter(object):
             overwrite_b=True)
         squared_maha = np.sum(z * z, axis=0)
         return squared_maha
+
+    def gating_distance_batch(self, mean, covariance, measurements,
+                              only_position=False):
+        """Compute gating distance between N state distributions and M
+        measurements.
+
+        All states are projected and all innovation covariances are factorized
+        in one stacked call, which is considerably faster than calling
+        `gating_distance` once per state.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional array of state covariance matrices.
+        measurements : ndarray
+            An Mx4 dimensional matrix of M measurements, each in
+            format (x, y, a, h) where (x, y) is the bounding box center
+            position, a the aspect ratio, and h the height.
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+
+        Returns
+        -------
+        ndarray
+            Returns an NxM matrix, where element (i, j) contains the squared
+            Mahalanobis distance between (mean[i], covariance[i]) and
+            `measurements[j]`.
+
+        """
+        measurements = np.asarray(measurements).reshape(-1, 4)
+        if len(mean) == 0 or len(measurements) == 0:
+            return np.zeros((len(mean), len(measurements)))
+        mean, covariance = self.project_batch(mean, covariance)
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        cholesky_factor = np.linalg.cholesky(covariance)
+        d = measurements[np.newaxis, :, :] - mean[:, np.newaxis, :]
+        z = np.linalg.solve(cholesky_factor, d.transpose(0, 2, 1))
+        squared_maha = np.sum(z * z, axis=1)
+        return squared_maha
+
+    def gating_distance_pairs(self, mean, covariance, measurements, rows,
+                              cols, only_position=False):
+        """Compute gating distance for selected pairs of state distributions
+        and measurements.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional array of state covariance matrices.
+        measurements : ndarray
+            An Mx4 dimensional matrix of M measurements, each in
+            format (x, y, a, h) where (x, y) is the bounding box center
+            position, a the aspect ratio, and h the height.
+        rows : ndarray
+            An integer array of P state indices.
+        cols : ndarray
+            An integer array of P measurement indices.
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+
+        Returns
+        -------
+        ndarray
+            Returns an array of length P, where element k contains the squared
+            Mahalanobis distance between (mean[rows[k]], covariance[rows[k]])
+            and `measurements[cols[k]]`.
+
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        if len(rows) == 0:
+            return np.zeros((0, ))
+        measurements = np.asarray(measurements).reshape(-1, 4)
+
+        # Factorize each involved state once, not once per pair.
+        states, inverse = np.unique(rows, return_inverse=True)
+        mean, covariance = self.project_batch(
+            mean[states], covariance[states])
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        cholesky_factor = np.linalg.cholesky(covariance)
+        d = measurements[cols] - mean[inverse]
+        z = np.linalg.solve(cholesky_factor[inverse], d[:, :, np.newaxis])
+        squared_maha = np.sum(z * z, axis=(1, 2))
+        return squared_maha
+
+    def gating_rectangles(self, mean, covariance, only_position=False):
+        """Compute axis-aligned bounds of the gating regions of N state
+        distributions in the image plane.
+
+        A measurement whose (x, y) position lies outside of these bounds has
+        a gating distance above the chi-square threshold used by
+        `linear_assignment.gate_cost_matrix`, because the Mahalanobis distance
+        of any subset of coordinates cannot exceed the full distance.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional array of state covariance matrices.
+        only_position : Optional[bool]
+            If True, bounds are computed for the 2 degrees of freedom gate of
+            the bounding box center position only.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx2 lower and upper (x, y) bounds of each gating
+            region.
+
+        """
+        gating_threshold = chi2inv95[2 if only_position else 4]
+        mean, covariance = self.project_batch(mean, covariance)
+        variance = np.diagonal(covariance, axis1=1, axis2=2)[:, :2]
+        # Slightly enlarged to stay conservative under round-off.
+        half_extent = np.sqrt(gating_threshold * variance) * (1. + 1e-6)
+        return mean[:, :2] - half_extent, mean[:, :2] + half_extent
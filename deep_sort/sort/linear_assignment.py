@@ -1,17 +1,226 @@
 # vim: expandtab:ts=4:sw=4
 from __future__ import absolute_import
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components
 # from sklearn.utils.linear_assignment_ import linear_assignment
 from scipy.optimize import linear_sum_assignment as linear_assignment
 from . import kalman_filter
 
+try:
+    import lap
+except ImportError:  # lapjv is optional, scipy is always available
+    lap = None
+
 
 INFTY_COST = 1e+5
 
+# With `decompose`, matrices with at least this many entries are split into
+# the connected components of their feasible pairs before solving; below that
+# the overhead of finding the components outweighs the savings. Components
+# with at least PARALLEL_MIN_SIZE entries are solved concurrently.
+DECOMPOSE_MIN_SIZE = 512 * 512
+PARALLEL_MIN_SIZE = 128 * 128
+# Matrices with a larger fraction of feasible pairs are solved as a whole.
+DECOMPOSE_MAX_DENSITY = 0.05
+
+_executor = None
+
+
+def _solve_scipy(cost_matrix, max_distance):
+    return linear_assignment(cost_matrix)
+
+
+def _solve_lapjv(cost_matrix, max_distance):
+    if lap is None:
+        raise ValueError("The 'lapjv' solver requires the lap package")
+    # Infeasible entries are clipped to a constant by the caller, which makes
+    # the full-cardinality problem equivalent to solving with `cost_limit`
+    # (and considerably faster than lapjv's padded cost_limit variant).
+    _, x, _ = lap.lapjv(
+        np.ascontiguousarray(cost_matrix, dtype=np.float64),
+        extend_cost=True)
+    row_indices = np.flatnonzero(x >= 0)
+    return row_indices, x[row_indices].astype(np.int64)
+
+
+def _solve_greedy(cost_matrix, max_distance):
+    row_indices, col_indices = np.nonzero(cost_matrix <= max_distance)
+    order = np.argsort(cost_matrix[row_indices, col_indices], kind="stable")
+    row_used = np.zeros(cost_matrix.shape[0], dtype=bool)
+    col_used = np.zeros(cost_matrix.shape[1], dtype=bool)
+    keep = []
+    for k in order:
+        row, col = row_indices[k], col_indices[k]
+        if row_used[row] or col_used[col]:
+            continue
+        row_used[row] = col_used[col] = True
+        keep.append(k)
+    keep = np.asarray(keep, dtype=np.int64)
+    keep = keep[np.argsort(row_indices[keep])]
+    return row_indices[keep], col_indices[keep]
+
+
+def _solve_auto(cost_matrix, max_distance):
+    feasible = cost_matrix <= max_distance
+    if (np.all(feasible.sum(axis=0) <= 1)
+            and np.all(feasible.sum(axis=1) <= 1)):
+        # Every track and detection has at most one candidate: the greedy
+        # assignment is optimal.
+        return _solve_greedy(cost_matrix, max_distance)
+    # lapjv is not consistently faster than scipy on gated tracking problems
+    # (see scripts/benchmark_assignment.py), so it is only used on request.
+    return _solve_scipy(cost_matrix, max_distance)
+
+
+SOLVERS = {
+    "auto": _solve_auto,
+    "scipy": _solve_scipy,
+    "lapjv": _solve_lapjv,
+    "greedy": _solve_greedy,
+}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=os.cpu_count())
+    return _executor
+
+
+def _group(indices, labels):
+    # Split `indices` into groups of equal `labels`, ordered by label.
+    indices = indices[np.argsort(labels[indices], kind="stable")]
+    sorted_labels = labels[indices]
+    starts = np.flatnonzero(sorted_labels[1:] != sorted_labels[:-1]) + 1
+    return np.split(indices, starts) if len(indices) > 0 else []
+
+
+def _solve_components(cost_matrix, max_distance, solve_fn):
+    n_rows, n_cols = cost_matrix.shape
+    feasible = cost_matrix <= max_distance
+    if feasible.mean() > DECOMPOSE_MAX_DENSITY:
+        # Almost certainly a single component.
+        return solve_fn(cost_matrix, max_distance)
+
+    # Rows and columns are the vertices of a bipartite graph whose edges are
+    # the feasible pairs. An optimal assignment of the gated problem is a
+    # maximum weight matching with weights (max_distance - cost), so each
+    # connected component can be solved on its own.
+    rows, cols = np.nonzero(feasible)
+    graph = scipy.sparse.coo_matrix(
+        (np.ones(len(rows), dtype=bool), (rows, n_rows + cols)),
+        shape=(n_rows + n_cols, n_rows + n_cols))
+    num_components, labels = connected_components(graph, directed=False)
+    row_labels, col_labels = labels[:n_rows], labels[n_rows:]
+    has_row = np.zeros(n_rows, dtype=bool)
+    has_row[rows] = True
+    has_col = np.zeros(n_cols, dtype=bool)
+    has_col[cols] = True
+    rows_per_component = np.bincount(
+        row_labels[has_row], minlength=num_components)
+    cols_per_component = np.bincount(
+        col_labels[has_col], minlength=num_components)
+
+    component_size = rows_per_component * cols_per_component
+    if component_size.max() >= cost_matrix.size // 2:
+        # Dominated by a single component, nothing to gain.
+        return solve_fn(cost_matrix, max_distance)
+
+    # Components with a single row or column are assigned their cheapest pair.
+    single_rows = np.flatnonzero(
+        has_row & (rows_per_component[row_labels] == 1))
+    single_cols = np.flatnonzero(
+        has_col & (cols_per_component[col_labels] == 1)
+        & (rows_per_component[col_labels] > 1))
+    row_indices = [single_rows, np.where(
+        feasible[:, single_cols], cost_matrix[:, single_cols],
+        np.inf).argmin(axis=0)]
+    col_indices = [np.where(
+        feasible[single_rows], cost_matrix[single_rows],
+        np.inf).argmin(axis=1), single_cols]
+
+    # The remaining components go to the solver.
+    is_nontrivial = (rows_per_component > 1) & (cols_per_component > 1)
+    nontrivial_rows = np.flatnonzero(has_row & is_nontrivial[row_labels])
+    nontrivial_cols = np.flatnonzero(has_col & is_nontrivial[col_labels])
+    subproblems = list(zip(
+        _group(nontrivial_rows, row_labels),
+        _group(nontrivial_cols, col_labels)))
+
+    def solve_subproblem(subproblem):
+        sub_rows, sub_cols = subproblem
+        sub_matrix = cost_matrix[np.ix_(sub_rows, sub_cols)]
+        r, c = solve_fn(sub_matrix, max_distance)
+        is_match = sub_matrix[r, c] <= max_distance
+        return sub_rows[r[is_match]], sub_cols[c[is_match]]
+
+    num_large = sum(
+        len(r) * len(c) >= PARALLEL_MIN_SIZE for r, c in subproblems)
+    if num_large > 1 and (os.cpu_count() or 1) > 1:
+        results = _get_executor().map(solve_subproblem, subproblems)
+    else:
+        results = map(solve_subproblem, subproblems)
+    for r, c in results:
+        row_indices.append(r)
+        col_indices.append(c)
+
+    row_indices = np.concatenate(row_indices)
+    col_indices = np.concatenate(col_indices)
+    order = np.argsort(row_indices)
+    return row_indices[order], col_indices[order]
+
+
+def solve(cost_matrix, max_distance, solver="scipy", decompose=False):
+    """Solve a gated linear assignment problem.
+
+    Parameters
+    ----------
+    cost_matrix : ndarray
+        The NxM dimensional cost matrix. Entries larger than `max_distance`
+        are infeasible.
+    max_distance : float
+        Gating threshold.
+    solver : str
+        One of the keys in `SOLVERS`. `scipy` and `lapjv` are exact; `greedy`
+        assigns pairs in order of increasing cost and is exact only if no two
+        feasible pairs share a row or column. `auto` picks `greedy` in that
+        case and `scipy` otherwise. The solvers agree on the matches
+        but may leave different infeasible pairs unassigned, which changes the
+        order of unmatched detections and therefore the ids of new tracks;
+        only `scipy` numbers them as the original implementation did.
+    decompose : bool
+        If True, matrices with at least `DECOMPOSE_MIN_SIZE` entries are split
+        into independent subproblems (the connected components of the
+        feasible pairs), which are solved separately. Components with a
+        single row or column are assigned their cheapest pair without running
+        the solver. The matches are the same, but like the other solvers
+        this may change the ids of new tracks. Only pays off for very large
+        and sparse problems (see scripts/benchmark_assignment.py).
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        Row and column indices of the assignment, sorted by row. Pairs with a
+        cost larger than `max_distance` may be included and must be filtered
+        by the caller.
+
+    """
+    try:
+        solve_fn = SOLVERS[solver]
+    except KeyError:
+        raise ValueError("Invalid assignment solver %r, expected one of %s" % (
+            solver, ", ".join(sorted(SOLVERS))))
+    if decompose and cost_matrix.size >= DECOMPOSE_MIN_SIZE:
+        return _solve_components(cost_matrix, max_distance, solve_fn)
+    return solve_fn(cost_matrix, max_distance)
+
 
 def min_cost_matching(
         distance_metric, max_distance, tracks, detections, track_indices=None,
-        detection_indices=None):
+        detection_indices=None, solver="scipy", decompose=False):
     """Solve linear assignment problem.
 
     Parameters
@@ -25,61 +234,72 @@ def min_cost_matching(
     max_distance : float
         Gating threshold. Associations with cost larger than this value are
         disregarded.
-    tracks : List[track.Track]
-        A list of predicted tracks at the current time step.
+    tracks : track.TrackTable
+        The predicted tracks at the current time step.
     detections : List[detection.Detection]
         A list of detections at the current time step.
-    track_indices : List[int]
-        List of track indices that maps rows in `cost_matrix` to tracks in
-        `tracks` (see description above).
-    detection_indices : List[int]
-        List of detection indices that maps columns in `cost_matrix` to
-        detections in `detections` (see description above).
+    track_indices : Optional[array_like]
+        Array of track indices that maps rows in `cost_matrix` to tracks in
+        `tracks` (see description above). Defaults to all tracks.
+    detection_indices : Optional[array_like]
+        Array of detection indices that maps columns in `cost_matrix` to
+        detections in `detections` (see description above). Defaults to all
+        detections.
+    solver : str
+        Name of the assignment solver, see `solve`.
+    decompose : bool
+        Solve the connected components separately, see `solve`.
 
     Returns
     -------
-    (List[(int, int)], List[int], List[int])
+    (ndarray, ndarray, ndarray)
         Returns a tuple with the following three entries:
-        * A list of matched track and detection indices.
-        * A list of unmatched track indices.
-        * A list of unmatched detection indices.
+        * A Kx2 integer array of matched track and detection indices.
+        * An integer array of unmatched track indices.
+        * An integer array of unmatched detection indices.
 
     """
     if track_indices is None:
         track_indices = np.arange(len(tracks))
     if detection_indices is None:
         detection_indices = np.arange(len(detections))
+    track_indices = np.asarray(track_indices, dtype=np.int64)
+    detection_indices = np.asarray(detection_indices, dtype=np.int64)
 
     if len(detection_indices) == 0 or len(track_indices) == 0:
-        return [], track_indices, detection_indices  # Nothing to match.
+        # Nothing to match.
+        return _no_matches(), track_indices, detection_indices
 
     cost_matrix = distance_metric(
         tracks, detections, track_indices, detection_indices)
     cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
 
-    row_indices, col_indices = linear_assignment(cost_matrix)
-
-    matches, unmatched_tracks, unmatched_detections = [], [], []
-    for col, detection_idx in enumerate(detection_indices):
-        if col not in col_indices:
-            unmatched_detections.append(detection_idx)
-    for row, track_idx in enumerate(track_indices):
-        if row not in row_indices:
-            unmatched_tracks.append(track_idx)
-    for row, col in zip(row_indices, col_indices):
-        track_idx = track_indices[row]
-        detection_idx = detection_indices[col]
-        if cost_matrix[row, col] > max_distance:
-            unmatched_tracks.append(track_idx)
-            unmatched_detections.append(detection_idx)
-        else:
-            matches.append((track_idx, detection_idx))
+    row_indices, col_indices = solve(
+        cost_matrix, max_distance, solver, decompose)
+    is_match = cost_matrix[row_indices, col_indices] <= max_distance
+
+    # Unassigned rows and columns come first, followed by assignments that
+    # were rejected by the gate (in solver order).
+    track_assigned = np.zeros(len(track_indices), dtype=bool)
+    track_assigned[row_indices] = True
+    detection_assigned = np.zeros(len(detection_indices), dtype=bool)
+    detection_assigned[col_indices] = True
+
+    matches = np.stack((
+        track_indices[row_indices[is_match]],
+        detection_indices[col_indices[is_match]]), axis=1)
+    unmatched_tracks = np.r_[
+        track_indices[~track_assigned], track_indices[row_indices[~is_match]]]
+    unmatched_detections = np.r_[
+        detection_indices[~detection_assigned],
+        detection_indices[col_indices[~is_match]]]
     return matches, unmatched_tracks, unmatched_detections
 
 
 def matching_cascade(
         distance_metric, max_distance, cascade_depth, tracks, detections,
-        track_indices=None, detection_indices=None):
+        track_indices=None, detection_indices=None, solver="scipy",
+        decompose=False):
     """Run matching cascade.
 
     Parameters
@@ -95,57 +315,115 @@ def matching_cascade(
         disregarded.
     cascade_depth: int
         The cascade depth, should be se to the maximum track age.
-    tracks : List[track.Track]
-        A list of predicted tracks at the current time step.
+    tracks : track.TrackTable
+        The predicted tracks at the current time step.
     detections : List[detection.Detection]
         A list of detections at the current time step.
-    track_indices : Optional[List[int]]
-        List of track indices that maps rows in `cost_matrix` to tracks in
+    track_indices : Optional[array_like]
+        Array of track indices that maps rows in `cost_matrix` to tracks in
         `tracks` (see description above). Defaults to all tracks.
-    detection_indices : Optional[List[int]]
-        List of detection indices that maps columns in `cost_matrix` to
+    detection_indices : Optional[array_like]
+        Array of detection indices that maps columns in `cost_matrix` to
         detections in `detections` (see description above). Defaults to all
         detections.
+    solver : str
+        Name of the assignment solver, see `solve`.
+    decompose : bool
+        Solve the connected components separately, see `solve`.
 
     Returns
     -------
-    (List[(int, int)], List[int], List[int])
+    (ndarray, ndarray, ndarray)
         Returns a tuple with the following three entries:
-        * A list of matched track and detection indices.
-        * A list of unmatched track indices.
-        * A list of unmatched detection indices.
+        * A Kx2 integer array of matched track and detection indices.
+        * An integer array of unmatched track indices.
+        * An integer array of unmatched detection indices.
 
     """
     if track_indices is None:
-        track_indices = list(range(len(tracks)))
+        track_indices = np.arange(len(tracks))
     if detection_indices is None:
-        detection_indices = list(range(len(detections)))
+        detection_indices = np.arange(len(detections))
+
+    track_indices = np.asarray(track_indices, dtype=np.int64)
+    time_since_update = tracks.time_since_update[track_indices]
 
-    unmatched_detections = detection_indices
-    matches = []
+    unmatched_detections = np.asarray(detection_indices, dtype=np.int64)
+    matches = [_no_matches()]
     for level in range(cascade_depth):
         if len(unmatched_detections) == 0:  # No detections left
             break
 
-        track_indices_l = [
-            k for k in track_indices
-            if tracks[k].time_since_update == 1 + level
-        ]
+        track_indices_l = track_indices[time_since_update == 1 + level]
         if len(track_indices_l) == 0:  # Nothing to match at this level
             continue
 
         matches_l, _, unmatched_detections = \
             min_cost_matching(
                 distance_metric, max_distance, tracks, detections,
-                track_indices_l, unmatched_detections)
-        matches += matches_l
-    unmatched_tracks = list(set(track_indices) - set(k for k, _ in matches))
+                track_indices_l, unmatched_detections, solver, decompose)
+        matches.append(matches_l)
+    matches = np.concatenate(matches, axis=0)
+    # In the iteration order of a set difference, as before: it orders the
+    # rows of the IoU association, and through its gate-rejected pairs the
+    # ids given to new tracks.
+    unmatched_tracks = np.array(list(
+        set(track_indices.tolist()) - set(matches[:, 0].tolist())),
+        dtype=np.int64)
     return matches, unmatched_tracks, unmatched_detections
 
 
+def _no_matches():
+    return np.zeros((0, 2), dtype=np.int64)
+
+
+def gating_distance_matrix(
+        kf, tracks, detections, track_indices=None, detection_indices=None,
+        only_position=False):
+    """Compute the squared Mahalanobis distance between the predicted state
+    distributions of tracks and detections.
+
+    Parameters
+    ----------
+    kf : The Kalman filter.
+    tracks : track.TrackTable
+        The predicted tracks at the current time step.
+    detections : List[detection.Detection]
+        A list of detections at the current time step.
+    track_indices : Optional[List[int]]
+        List of track indices that maps rows in the result to tracks in
+        `tracks`. Defaults to all tracks.
+    detection_indices : Optional[List[int]]
+        List of detection indices that maps columns in the result to
+        detections in `detections`. Defaults to all detections.
+    only_position : Optional[bool]
+        If True, only the x, y position of the state distribution is considered
+        during gating. Defaults to False.
+
+    Returns
+    -------
+    ndarray
+        Returns a matrix of shape len(track_indices), len(detection_indices)
+        where entry (i, j) is the squared Mahalanobis distance between
+        `tracks[track_indices[i]]` and `detections[detection_indices[j]]`.
+
+    """
+    if track_indices is None:
+        track_indices = np.arange(len(tracks))
+    if detection_indices is None:
+        detection_indices = np.arange(len(detections))
+    track_indices = np.asarray(track_indices, dtype=np.int64)
+
+    measurements = np.asarray(
+        [detections[i].to_xyah() for i in detection_indices])
+    return kf.gating_distance_batch(
+        tracks.mean[track_indices], tracks.covariance[track_indices],
+        measurements, only_position)
+
+
 def gate_cost_matrix(
         kf, cost_matrix, tracks, detections, track_indices, detection_indices,
-        gated_cost=INFTY_COST, only_position=False):
+        gated_cost=INFTY_COST, only_position=False, gating_distance=None):
     """Invalidate infeasible entries in cost matrix based on the state
     distributions obtained by Kalman filtering.
 
@@ -157,8 +435,8 @@ def gate_cost_matrix(
         and M is the number of detection indices, such that entry (i, j) is the
         association cost between `tracks[track_indices[i]]` and
         `detections[detection_indices[j]]`.
-    tracks : List[track.Track]
-        A list of predicted tracks at the current time step.
+    tracks : track.TrackTable
+        The predicted tracks at the current time step.
     detections : List[detection.Detection]
         A list of detections at the current time step.
     track_indices : List[int]
@@ -173,6 +451,11 @@ def gate_cost_matrix(
     only_position : Optional[bool]
         If True, only the x, y position of the state distribution is considered
         during gating. Defaults to False.
+    gating_distance : Optional[ndarray]
+        The NxM dimensional matrix of squared Mahalanobis distances for the
+        given track and detection indices, e.g., a slice of a matrix computed
+        once per frame with `gating_distance_matrix`. Computed on demand if
+        None.
 
     Returns
     -------
@@ -182,11 +465,9 @@ def gate_cost_matrix(
     """
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
-    measurements = np.asarray(
-        [detections[i].to_xyah() for i in detection_indices])
-    for row, track_idx in enumerate(track_indices):
-        track = tracks[track_idx]
-        gating_distance = kf.gating_distance(
-            track.mean, track.covariance, measurements, only_position)
-        cost_matrix[row, gating_distance > gating_threshold] = gated_cost
+    if gating_distance is None:
+        gating_distance = gating_distance_matrix(
+            kf, tracks, detections, track_indices, detection_indices,
+            only_position)
+    cost_matrix[gating_distance > gating_threshold] = gated_cost
     return cost_matrix
@@ -1,7 +1,14 @@
 # vim: expandtab:ts=4:sw=4
+import functools
 import numpy as np
 
 
+def _normalize(a):
+    """Scale the rows of `a` to unit length."""
+    a = np.asarray(a)
+    return a / np.linalg.norm(a, axis=1, keepdims=True)
+
+
 def _pdist(a, b):
     """Compute pair-wise squared distance between points in `a` and `b`.
 
@@ -54,7 +61,7 @@ def _cosine_distance(a, b, data_is_normalized=False):
     return 1. - np.dot(a, b.T)
 
 
-def _nn_euclidean_distance(x, y):
+def _nn_euclidean_distance(x, y, offsets=None):
     """ Helper function for nearest neighbor distance metric (Euclidean).
 
     Parameters
@@ -63,19 +70,25 @@ def _nn_euclidean_distance(x, y):
         A matrix of N row-vectors (sample points).
     y : ndarray
         A matrix of M row-vectors (query points).
+    offsets : Optional[ndarray]
+        If not None, `x` contains the samples of K targets one after another
+        and `offsets` holds the index of the first sample of each target.
 
     Returns
     -------
     ndarray
         A vector of length M that contains for each entry in `y` the
-        smallest Euclidean distance to a sample in `x`.
+        smallest Euclidean distance to a sample in `x`. If `offsets` is given,
+        a KxM matrix with the smallest distance to a sample of each target.
 
     """
     distances = _pdist(x, y)
-    return np.maximum(0.0, distances.min(axis=0))
+    if offsets is None:
+        return np.maximum(0.0, distances.min(axis=0))
+    return np.maximum(0.0, np.minimum.reduceat(distances, offsets, axis=0))
 
 
-def _nn_cosine_distance(x, y):
+def _nn_cosine_distance(x, y, offsets=None, data_is_normalized=False):
     """ Helper function for nearest neighbor distance metric (cosine).
 
     Parameters
@@ -84,16 +97,231 @@ def _nn_cosine_distance(x, y):
         A matrix of N row-vectors (sample points).
     y : ndarray
         A matrix of M row-vectors (query points).
+    offsets : Optional[ndarray]
+        If not None, `x` contains the samples of K targets one after another
+        and `offsets` holds the index of the first sample of each target.
+    data_is_normalized : Optional[bool]
+        If True, assumes rows in x and y are unit length vectors.
 
     Returns
     -------
     ndarray
         A vector of length M that contains for each entry in `y` the
-        smallest cosine distance to a sample in `x`.
+        smallest cosine distance to a sample in `x`. If `offsets` is given,
+        a KxM matrix with the smallest distance to a sample of each target.
+
+    """
+    distances = _cosine_distance(x, y, data_is_normalized)
+    if offsets is None:
+        return distances.min(axis=0)
+    return np.minimum.reduceat(distances, offsets, axis=0)
+
 
+class FeatureGallery(object):
     """
-    distances = _cosine_distance(x, y)
-    return distances.min(axis=0)
+    A gallery of feature vectors that keeps the most recent samples of each
+    target in a fixed-size ring buffer.
+
+    With a budget, the buffers of all targets live in one preallocated float32
+    array of shape `(capacity, budget, dim)`, where each target owns one slot
+    along the first axis. Adding samples writes into the target's slot in
+    place and evicting a target only returns its slot to a free list. Without
+    a budget, each target owns a separate buffer that grows with its history.
+
+    Parameters
+    ----------
+    budget : Optional[int]
+        If not None, fix samples per target to at most this number. Older
+        samples are overwritten when the budget is reached. Otherwise, buffers
+        grow as needed.
+    capacity : Optional[int]
+        The number of target slots to preallocate. The pool grows when more
+        targets are stored.
+
+    Attributes
+    ----------
+    data : ndarray | NoneType
+        With a budget, the `(capacity, budget, dim)` sample buffers. Allocated
+        on the first call to `partial_fit`, once the feature dimensionality is
+        known.
+    buffers : Dict[int -> ndarray]
+        Without a budget, a dictionary that maps from slots to their growable
+        `(rows, dim)` sample buffer, of which the first `counts[slot]` rows are
+        used.
+    counts : ndarray
+        For each slot, the total number of samples written so far.
+    slots : Dict[int -> int]
+        A dictionary that maps from target identities to their slot in `data`.
+
+    """
+
+    def __init__(self, budget=None, capacity=64):
+        self.budget = budget
+        self.data = None
+        self.counts = np.zeros((capacity, ), dtype=np.int64)
+        self.slots = {}
+        self.buffers = {}
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, target):
+        return target in self.slots
+
+    @property
+    def targets(self):
+        """The identities of all targets in the gallery."""
+        return list(self.slots.keys())
+
+    def num_samples(self, target):
+        """Returns the number of samples stored for `target`."""
+        count = int(self.counts[self.slots[target]])
+        return count if self.budget is None else min(count, self.budget)
+
+    def get(self, target):
+        """Returns an `Lx(dim)` view of the L samples stored for `target`.
+        Rows are in ring buffer order, not in the order they were added.
+        """
+        slot = self.slots[target]
+        if self.budget is None:
+            return self.buffers[slot][:self.counts[slot]]
+        return self.data[slot, :min(self.counts[slot], self.budget)]
+
+    def _grow_capacity(self):
+        capacity = len(self.counts)
+        self.counts = np.r_[self.counts, np.zeros_like(self.counts)]
+        if self.data is not None:
+            self.data = np.concatenate(
+                (self.data, np.zeros_like(self.data)), axis=0)
+        self._free += list(range(2 * capacity - 1, capacity - 1, -1))
+
+    def _append(self, slot, features):
+        # Only used without budget: buffers double when full, independently
+        # of the other targets.
+        count = self.counts[slot]
+        buffer = self.buffers.get(slot)
+        if buffer is None or count + len(features) > len(buffer):
+            size = max(16, count + len(features),
+                       0 if buffer is None else 2 * len(buffer))
+            grown = np.empty((size, features.shape[1]), dtype=np.float32)
+            if buffer is not None:
+                grown[:count] = buffer[:count]
+            self.buffers[slot] = buffer = grown
+        buffer[count:count + len(features)] = features
+
+    def _slot(self, target):
+        slot = self.slots.get(target)
+        if slot is None:
+            if len(self._free) == 0:
+                self._grow_capacity()
+            slot = self._free.pop()
+            self.counts[slot] = 0
+            self.slots[target] = slot
+        return slot
+
+    def partial_fit(self, features, targets):
+        """Add samples to the gallery.
+
+        Parameters
+        ----------
+        features : ndarray
+            An NxM matrix of N features of dimensionality M.
+        targets : ndarray
+            An integer array of associated target identities.
+
+        """
+        features = np.asarray(features, dtype=np.float32)
+        targets = np.asarray(targets, dtype=np.int64)
+        if len(features) == 0:
+            return
+        if self.data is None and self.budget is not None:
+            self.data = np.zeros(
+                (len(self.counts), self.budget, features.shape[1]),
+                dtype=np.float32)
+
+        unique_targets, inverse = np.unique(targets, return_inverse=True)
+        unique_slots = np.array(
+            [self._slot(int(t)) for t in unique_targets], dtype=np.int64)
+        num_new = np.bincount(inverse)
+
+        # Rank of each sample among the new samples of its target, in order.
+        order = np.argsort(inverse, kind="stable")
+        group_start = np.r_[0, np.cumsum(num_new)[:-1]]
+
+        if self.budget is None:
+            for slot, start, n in zip(unique_slots, group_start, num_new):
+                self._append(slot, features[order[start:start + n]])
+            self.counts[unique_slots] += num_new
+            return
+
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order)) - np.repeat(group_start, num_new)
+
+        # Only the last `budget` new samples of each target survive.
+        keep = rank >= num_new[inverse] - self.budget
+        slots = unique_slots[inverse[keep]]
+        positions = (self.counts[slots] + rank[keep]) % self.budget
+        self.data[slots, positions] = features[keep]
+        self.counts[unique_slots] += num_new
+
+    def retain(self, active_targets):
+        """Evict all targets that are not in `active_targets`.
+
+        Parameters
+        ----------
+        active_targets : List[int]
+            A list of targets that are currently present in the scene.
+
+        """
+        active_targets = set(int(t) for t in active_targets)
+        for target in [t for t in self.slots if t not in active_targets]:
+            slot = self.slots.pop(target)
+            self.counts[slot] = 0
+            self.buffers.pop(slot, None)
+            self._free.append(slot)
+
+    def concatenate(self, targets):
+        """Gather the samples of several targets into one matrix.
+
+        Parameters
+        ----------
+        targets : List[int]
+            The target identities to gather samples of.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the stacked samples of all `targets`, one target after
+            another, and the index of the first sample of each target.
+
+        """
+        slots = np.array([self.slots[t] for t in targets], dtype=np.int64)
+        if self.budget is None:
+            num_samples = self.counts[slots]
+            offsets = np.r_[0, np.cumsum(num_samples)[:-1]]
+            samples = np.concatenate(
+                [self.buffers[slot][:n] for slot, n in zip(slots, num_samples)])
+            return samples, offsets
+        num_samples = np.minimum(self.counts[slots], self.budget)
+        offsets = np.r_[0, np.cumsum(num_samples)[:-1]]
+        rows = np.repeat(slots * self.budget - offsets, num_samples) + \
+            np.arange(num_samples.sum())
+        samples = self.data.reshape(-1, self.data.shape[2])[rows]
+        return samples, offsets
+
+    def memory_per_target(self):
+        """Returns a dictionary that maps from target identities to the number
+        of bytes reserved for their samples.
+        """
+        if self.budget is None:
+            return {target: self.buffers[slot].nbytes
+                    if slot in self.buffers else 0
+                    for target, slot in self.slots.items()}
+        if self.data is None:
+            return {target: 0 for target in self.slots}
+        nbytes = self.data[0].nbytes
+        return {target: nbytes for target in self.slots}
 
 
 class NearestNeighborDistanceMetric(object):
@@ -114,9 +342,12 @@ class NearestNeighborDistanceMetric(object):
 
     Attributes
     ----------
-    samples : Dict[int -> List[ndarray]]
-        A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+    gallery : FeatureGallery
+        The samples that have been observed so far, stored per target.
+    samples : Dict[int -> ndarray]
+        A dictionary that maps from target identities to the samples that are
+        currently stored for them (read-only). With the cosine metric, samples
+        are stored normalized to unit length.
 
     """
 
@@ -125,14 +356,22 @@ class NearestNeighborDistanceMetric(object):
 
         if metric == "euclidean":
             self._metric = _nn_euclidean_distance
+            self._normalize = False
         elif metric == "cosine":
-            self._metric = _nn_cosine_distance
+            self._metric = functools.partial(
+                _nn_cosine_distance, data_is_normalized=True)
+            self._normalize = True
         else:
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
         self.matching_threshold = matching_threshold
         self.budget = budget
-        self.samples = {}
+        self.gallery = FeatureGallery(budget)
+
+    @property
+    def samples(self):
+        return {target: self.gallery.get(target)
+                for target in self.gallery.targets}
 
     def partial_fit(self, features, targets, active_targets):
         """Update the distance metric with new data.
@@ -147,11 +386,10 @@ class NearestNeighborDistanceMetric(object):
             A list of targets that are currently present in the scene.
 
         """
-        for feature, target in zip(features, targets):
-            self.samples.setdefault(target, []).append(feature)
-            if self.budget is not None:
-                self.samples[target] = self.samples[target][-self.budget:]
-        self.samples = {k: self.samples[k] for k in active_targets}
+        if self._normalize and len(features) > 0:
+            features = _normalize(features)
+        self.gallery.partial_fit(features, targets)
+        self.gallery.retain(active_targets)
 
     def distance(self, features, targets):
         """Compute distance between features and targets.
@@ -171,7 +409,60 @@ class NearestNeighborDistanceMetric(object):
             `targets[i]` and `features[j]`.
 
         """
-        cost_matrix = np.zeros((len(targets), len(features)))
-        for i, target in enumerate(targets):
-            cost_matrix[i, :] = self._metric(self.samples[target], features)
-        return cost_matrix
+        if len(targets) == 0 or len(features) == 0:
+            return np.zeros((len(targets), len(features)))
+        if self._normalize:
+            features = _normalize(features)
+        # One (sum of samples x dim) x (dim x features) product for all
+        # targets, reduced to the nearest sample of each target.
+        samples, offsets = self.gallery.concatenate(targets)
+        cost_matrix = self._metric(samples, features, offsets)
+        return cost_matrix.astype(np.float64)
+
+    def pair_distance(self, features, targets, target_indices,
+                      feature_indices):
+        """Compute distance between selected pairs of features and targets.
+
+        Parameters
+        ----------
+        features : ndarray
+            An NxM matrix of N features of dimensionality M.
+        targets : List[int]
+            A list of targets to match the given `features` against.
+        target_indices : ndarray
+            An integer array of P indices into `targets`.
+        feature_indices : ndarray
+            An integer array of P indices into `features`.
+
+        Returns
+        -------
+        ndarray
+            Returns an array of length P, where element k contains the closest
+            distance between `targets[target_indices[k]]` and
+            `features[feature_indices[k]]`.
+
+        """
+        target_indices = np.asarray(target_indices, dtype=np.int64)
+        feature_indices = np.asarray(feature_indices, dtype=np.int64)
+        distances = np.zeros((len(target_indices), ))
+        if len(target_indices) == 0:
+            return distances
+        if self._normalize:
+            features = _normalize(features)
+
+        # One (samples x dim) x (dim x candidates) product per target.
+        order = np.argsort(target_indices, kind="stable")
+        sorted_targets = target_indices[order]
+        starts = np.flatnonzero(
+            np.r_[True, sorted_targets[1:] != sorted_targets[:-1]])
+        for pairs in np.split(order, starts[1:]):
+            samples = self.gallery.get(targets[target_indices[pairs[0]]])
+            distances[pairs] = self._metric(
+                samples, features[feature_indices[pairs]])
+        return distances
+
+    def memory_per_target(self):
+        """Returns a dictionary that maps from target identities to the number
+        of bytes reserved for their gallery samples.
+        """
+        return self.gallery.memory_per_target()
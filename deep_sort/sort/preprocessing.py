@@ -3,7 +3,8 @@ import numpy as np
 import cv2
 
 
-def non_max_suppression(boxes, max_bbox_overlap, scores=None):
+def non_max_suppression(boxes, max_bbox_overlap, scores=None,
+                        use_torchvision=False):
     """Suppress overlapping detections.
 
     Original code from [1]_ has been adapted to include confidence score.
@@ -24,50 +25,90 @@ def non_max_suppression(boxes, max_bbox_overlap, scores=None):
     boxes : ndarray
         Array of ROIs (x, y, width, height).
     max_bbox_overlap : float
-        ROIs that overlap more than this values are suppressed.
+        ROIs that overlap more than this values are suppressed. The overlap of
+        a ROI with a higher scoring one is their intersection divided by the
+        area of the lower scoring ROI. Values >= 1 disable suppression.
     scores : Optional[array_like]
         Detector confidence score.
+    use_torchvision : Optional[bool]
+        If True, suppress with `torchvision.ops.nms`, which measures overlap
+        as intersection over union instead.
 
     Returns
     -------
     List[int]
-        Returns indices of detections that have survived non-maxima suppression.
+        Returns indices of detections that have survived non-maxima suppression,
+        in order of decreasing score.
 
     """
     if len(boxes) == 0:
         return []
 
-    boxes = boxes.astype(np.float)
-    pick = []
-
-    x1 = boxes[:, 0]
-    y1 = boxes[:, 1]
-    x2 = boxes[:, 2] + boxes[:, 0]
-    y2 = boxes[:, 3] + boxes[:, 1]
-
-    area = (x2 - x1 + 1) * (y2 - y1 + 1)
+    boxes = np.asarray(boxes, dtype=np.float64)
     if scores is not None:
-        idxs = np.argsort(scores)
+        order = np.argsort(scores)[::-1]
     else:
-        idxs = np.argsort(y2)
-
-    while len(idxs) > 0:
-        last = len(idxs) - 1
-        i = idxs[last]
-        pick.append(i)
-
-        xx1 = np.maximum(x1[i], x1[idxs[:last]])
-        yy1 = np.maximum(y1[i], y1[idxs[:last]])
-        xx2 = np.minimum(x2[i], x2[idxs[:last]])
-        yy2 = np.minimum(y2[i], y2[idxs[:last]])
-
-        w = np.maximum(0, xx2 - xx1 + 1)
-        h = np.maximum(0, yy2 - yy1 + 1)
-
-        overlap = (w * h) / area[idxs[:last]]
-
-        idxs = np.delete(
-            idxs, np.concatenate(
-                ([last], np.where(overlap > max_bbox_overlap)[0])))
+        order = np.argsort(boxes[:, 1] + boxes[:, 3])[::-1]
+    if max_bbox_overlap >= 1.:
+        # Nothing can overlap by more than its own area.
+        return order.tolist()
+    if use_torchvision:
+        return _torchvision_nms(boxes, max_bbox_overlap, scores, order)
+
+    if max_bbox_overlap < 0.:
+        # Even disjoint boxes overlap by more than this.
+        return order[:1].tolist()
+
+    n = len(order)
+    x1 = boxes[order, 0]
+    y1 = boxes[order, 1]
+    x2 = boxes[order, 2] + x1
+    y2 = boxes[order, 3] + y1
+    area = (x2 - x1 + 1) * (y2 - y1 + 1)
 
-    return pick
+    # Pairs of boxes whose x-ranges intersect: after sorting by x1, box k
+    # intersects the boxes that follow it up to x1 < x2[k] + 1.
+    by_x = np.argsort(x1, kind="stable")
+    end = np.searchsorted(x1[by_x], x2[by_x] + 1, side="left")
+    count = np.maximum(end - np.arange(n) - 1, 0)
+    first = np.repeat(np.arange(n), count)
+    second = first + 1 + np.arange(count.sum()) - np.repeat(
+        np.cumsum(count) - count, count)
+    i = np.minimum(by_x[first], by_x[second])
+    j = np.maximum(by_x[first], by_x[second])
+
+    # Overlap of box j with the higher scoring box i, as a fraction of the
+    # area of box j.
+    xx1 = np.maximum(x1[i], x1[j])
+    yy1 = np.maximum(y1[i], y1[j])
+    xx2 = np.minimum(x2[i], x2[j])
+    yy2 = np.minimum(y2[i], y2[j])
+    w = np.maximum(0, xx2 - xx1 + 1)
+    h = np.maximum(0, yy2 - yy1 + 1)
+    suppresses = (w * h) / area[j] > max_bbox_overlap
+    i, j = i[suppresses], j[suppresses]
+    by_i = np.argsort(i, kind="stable")
+    i, j = i[by_i], j[by_i]
+    start = np.searchsorted(i, np.arange(n + 1))
+
+    keep = np.zeros(n, dtype=bool)
+    suppressed = np.zeros(n, dtype=bool)
+    for k in range(n):
+        if suppressed[k]:
+            continue
+        keep[k] = True
+        suppressed[j[start[k]:start[k + 1]]] = True
+    return order[keep].tolist()
+
+
+def _torchvision_nms(boxes, max_bbox_overlap, scores, order):
+    import torch
+    import torchvision
+
+    if scores is None:
+        # Same priority as the default path: rank in `order`.
+        scores = np.empty(len(order))
+        scores[order] = np.arange(len(order), 0, -1)
+    boxes = torch.from_numpy(np.c_[boxes[:, :2], boxes[:, :2] + boxes[:, 2:]])
+    scores = torch.from_numpy(np.asarray(scores, dtype=np.float64))
+    return torchvision.ops.nms(boxes, scores, max_bbox_overlap).tolist()
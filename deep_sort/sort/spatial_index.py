@@ -0,0 +1,148 @@
+# vim: expandtab:ts=4:sw=4
+import itertools
+import numpy as np
+
+
+class GridIndex(object):
+    """
+    A uniform grid over axis-aligned rectangles, one per item, that finds the
+    rectangles containing a set of query points.
+
+    Every item is registered in all grid cells its rectangle overlaps. Items
+    are identified by a key and moved between cells only when the range of
+    cells they cover changes, so updating the index for slowly moving items is
+    cheap. Items that cover more than `max_cells` cells are not registered in
+    cells but tested against every query point.
+
+    Parameters
+    ----------
+    cell_size : float
+        Side length of a grid cell.
+    max_cells : int
+        Rectangles that cover more cells than this are kept in a separate list
+        of large items.
+
+    Attributes
+    ----------
+    keys : ndarray
+        The keys of all items, in the order given to the last call to
+        `update`.
+    lower : ndarray
+        The Nx2 lower corners of the item rectangles.
+    upper : ndarray
+        The Nx2 upper corners of the item rectangles.
+
+    """
+
+    def __init__(self, cell_size=64., max_cells=64):
+        self.cell_size = float(cell_size)
+        self.max_cells = max_cells
+        self.keys = np.zeros((0, ), dtype=np.int64)
+        self.lower = np.zeros((0, 2))
+        self.upper = np.zeros((0, 2))
+        self._cells = {}
+        self._ranges = {}
+        self._large = set()
+        self._positions = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _cells_of(self, cell_range):
+        x0, y0, x1, y1 = cell_range
+        return itertools.product(range(x0, x1 + 1), range(y0, y1 + 1))
+
+    def _insert(self, key, cell_range):
+        x0, y0, x1, y1 = cell_range
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > self.max_cells:
+            self._large.add(key)
+            return
+        for cell in self._cells_of(cell_range):
+            self._cells.setdefault(cell, set()).add(key)
+
+    def _remove(self, key, cell_range):
+        if key in self._large:
+            self._large.discard(key)
+            return
+        for cell in self._cells_of(cell_range):
+            members = self._cells[cell]
+            members.discard(key)
+            if len(members) == 0:
+                del self._cells[cell]
+
+    def update(self, keys, lower, upper):
+        """Replace the set of items.
+
+        Items whose key is not in `keys` are removed, all other items are
+        inserted or moved to their new rectangle.
+
+        Parameters
+        ----------
+        keys : array_like
+            An integer array of N unique item keys.
+        lower : ndarray
+            The Nx2 lower (x, y) corners of the item rectangles.
+        upper : ndarray
+            The Nx2 upper (x, y) corners of the item rectangles.
+
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        lower = np.asarray(lower, dtype=np.float64).reshape(-1, 2)
+        upper = np.asarray(upper, dtype=np.float64).reshape(-1, 2)
+        cell_ranges = np.c_[
+            np.floor(lower / self.cell_size),
+            np.floor(upper / self.cell_size)].astype(np.int64)
+        ranges = dict(zip(keys.tolist(), map(tuple, cell_ranges.tolist())))
+
+        for key in [k for k in self._ranges if k not in ranges]:
+            self._remove(key, self._ranges.pop(key))
+        for key, cell_range in ranges.items():
+            old_range = self._ranges.get(key)
+            if old_range == cell_range:
+                continue
+            if old_range is not None:
+                self._remove(key, old_range)
+            self._insert(key, cell_range)
+            self._ranges[key] = cell_range
+
+        self.keys, self.lower, self.upper = keys, lower, upper
+        self._positions = {k: i for i, k in enumerate(keys.tolist())}
+
+    def query(self, points):
+        """Find all pairs of items and query points such that the point lies
+        inside of the item's rectangle.
+
+        Parameters
+        ----------
+        points : ndarray
+            The Mx2 query points.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the item indices (positions in `keys`) and the point
+            indices of all pairs, sorted by item.
+
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        cells = np.floor(points / self.cell_size).astype(np.int64)
+        item_indices, point_indices = [], []
+        for j, cell in enumerate(map(tuple, cells.tolist())):
+            members = self._cells.get(cell, ())
+            item_indices.extend(self._positions[k] for k in members)
+            point_indices.extend([j] * len(members))
+        large = [self._positions[k] for k in self._large]
+        item_indices = np.r_[
+            np.asarray(item_indices, dtype=np.int64),
+            np.repeat(np.asarray(large, dtype=np.int64), len(points))]
+        point_indices = np.r_[
+            np.asarray(point_indices, dtype=np.int64),
+            np.tile(np.arange(len(points)), len(large))]
+
+        inside = np.all(
+            (self.lower[item_indices] <= points[point_indices])
+            & (points[point_indices] <= self.upper[item_indices]), axis=1)
+        item_indices, point_indices = \
+            item_indices[inside], point_indices[inside]
+        order = np.lexsort((point_indices, item_indices))
+        return item_indices[order], point_indices[order]
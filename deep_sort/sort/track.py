@@ -1,4 +1,5 @@
 # vim: expandtab:ts=4:sw=4
+import numpy as np
 
 
 class TrackState:
@@ -16,12 +17,327 @@ class TrackState:
     Deleted = 3
 
 
+class TrackTable(object):
+    """
+    Struct-of-arrays storage for a set of tracks. Row i of every array holds
+    the state of the i-th track, so that selection, state transitions and
+    filtering can be done with mask operations over all tracks at once.
+
+    Parameters
+    ----------
+    n_init : int
+        Number of consecutive detections before a track is confirmed. The
+        track state is set to `Deleted` if a miss occurs within the first
+        `n_init` frames.
+    max_age : int
+        The maximum number of consecutive misses before the track state is
+        set to `Deleted`.
+
+    Attributes
+    ----------
+    track_id : ndarray
+        The unique track identifiers (N dimensional).
+    state : ndarray
+        The current `TrackState` of each track (N dimensional).
+    hits : ndarray
+        Total number of measurement updates of each track (N dimensional).
+    age : ndarray
+        Total number of frames since first occurance (N dimensional).
+    time_since_update : ndarray
+        Total number of frames since last measurement update (N dimensional).
+    updates_since_feature : ndarray
+        Number of measurement updates since the last one that came with a
+        feature vector (N dimensional).
+    mean : ndarray
+        The Nx8 dimensional matrix of state mean vectors.
+    covariance : ndarray
+        The Nx8x8 dimensional array of state covariance matrices.
+    features : List[List[ndarray]]
+        A cache of features for each track. On each measurement update, the
+        associated feature vector is added to the track's list.
+
+    """
+
+    def __init__(self, n_init, max_age):
+        self.n_init = n_init
+        self.max_age = max_age
+
+        self.track_id = np.zeros((0, ), dtype=np.int64)
+        self.state = np.zeros((0, ), dtype=np.int64)
+        self.hits = np.zeros((0, ), dtype=np.int64)
+        self.age = np.zeros((0, ), dtype=np.int64)
+        self.time_since_update = np.zeros((0, ), dtype=np.int64)
+        self.updates_since_feature = np.zeros((0, ), dtype=np.int64)
+        self.mean = np.zeros((0, 8))
+        self.covariance = np.zeros((0, 8, 8))
+        self.features = []
+
+    def __len__(self):
+        return len(self.track_id)
+
+    def __getitem__(self, row):
+        return Track.view(self, row)
+
+    def __iter__(self):
+        return (Track.view(self, row) for row in range(len(self)))
+
+    def append(self, mean, covariance, track_id, features=None):
+        """Add new tentative tracks to the end of the table.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Kx8 dimensional matrix of initial state mean vectors.
+        covariance : ndarray
+            The Kx8x8 dimensional array of initial state covariance matrices.
+        track_id : array_like
+            The K unique identifiers of the new tracks.
+        features : Optional[List[ndarray | NoneType]]
+            Feature vectors of the detections the tracks originate from. If an
+            entry is not None, it is added to the `features` cache.
+
+        """
+        num_new = len(track_id)
+        if num_new == 0:
+            return
+        ones = np.ones((num_new, ), dtype=np.int64)
+
+        self.track_id = np.r_[self.track_id, np.asarray(track_id)]
+        self.state = np.r_[self.state, TrackState.Tentative * ones]
+        self.hits = np.r_[self.hits, ones]
+        self.age = np.r_[self.age, ones]
+        self.time_since_update = np.r_[self.time_since_update, 0 * ones]
+        self.mean = np.concatenate((self.mean, mean), axis=0)
+        self.covariance = np.concatenate(
+            (self.covariance, covariance), axis=0)
+        if features is None:
+            features = [None] * num_new
+        self.features += [[] if f is None else [f] for f in features]
+        self.updates_since_feature = np.r_[
+            self.updates_since_feature, [int(f is None) for f in features]]
+
+    def predict(self, kf):
+        """Propagate the state distributions of all tracks to the current time
+        step using a Kalman filter prediction step.
+
+        Parameters
+        ----------
+        kf : kalman_filter.KalmanFilter
+            The Kalman filter.
+
+        """
+        if len(self) == 0:
+            return
+        self.apply_prediction(
+            np.arange(len(self)), *kf.predict_batch(self.mean, self.covariance))
+
+    def apply_prediction(self, rows, mean, covariance):
+        """Set the predicted state distributions of the tracks in `rows`.
+
+        Parameters
+        ----------
+        rows : ndarray
+            Indices of the tracks to set.
+        mean : ndarray
+            The predicted mean vectors, one row per entry in `rows`.
+        covariance : ndarray
+            The predicted covariance matrices, one per entry in `rows`.
+
+        """
+        self.mean[rows] = mean
+        self.covariance[rows] = covariance
+        self.age[rows] += 1
+        self.time_since_update[rows] += 1
+
+    def update(self, kf, rows, measurements, features=None):
+        """Perform Kalman filter measurement update step and update the feature
+        cache of the tracks in `rows`.
+
+        Parameters
+        ----------
+        kf : kalman_filter.KalmanFilter
+            The Kalman filter.
+        rows : ndarray
+            Indices of the tracks to update. Each track may appear at most
+            once.
+        measurements : ndarray
+            The associated measurements (x, y, a, h), one row per entry in
+            `rows`.
+        features : Optional[List[ndarray | NoneType]]
+            The associated feature vectors, one per entry in `rows`.
+
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return
+        mean, covariance = kf.update_batch(
+            self.mean[rows], self.covariance[rows], measurements)
+        self.apply_update(rows, mean, covariance, features)
+
+    def apply_update(self, rows, mean, covariance, features=None):
+        """Set the measurement-corrected state distributions of the tracks in
+        `rows` and update their feature caches and counters.
+
+        Parameters
+        ----------
+        rows : ndarray
+            Indices of the tracks to set. Each track may appear at most once.
+        mean : ndarray
+            The corrected mean vectors, one row per entry in `rows`.
+        covariance : ndarray
+            The corrected covariance matrices, one per entry in `rows`.
+        features : Optional[List[ndarray | NoneType]]
+            The associated feature vectors, one per entry in `rows`.
+
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        self.mean[rows] = mean
+        self.covariance[rows] = covariance
+        if features is None:
+            features = [None] * len(rows)
+        for row, feature in zip(rows, features):
+            if feature is not None:
+                self.features[row].append(feature)
+                self.updates_since_feature[row] = 0
+            else:
+                self.updates_since_feature[row] += 1
+
+        self.hits[rows] += 1
+        self.time_since_update[rows] = 0
+        confirm = rows[
+            (self.state[rows] == TrackState.Tentative) &
+            (self.hits[rows] >= self.n_init)]
+        self.state[confirm] = TrackState.Confirmed
+
+    def mark_missed(self, rows):
+        """Mark the tracks in `rows` as missed (no association at the current
+        time step).
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        delete = (
+            (self.state[rows] == TrackState.Tentative) |
+            (self.time_since_update[rows] > self.max_age))
+        self.state[rows[delete]] = TrackState.Deleted
+
+    def is_tentative(self):
+        """Returns a boolean mask of tentative (unconfirmed) tracks."""
+        return self.state == TrackState.Tentative
+
+    def is_confirmed(self):
+        """Returns a boolean mask of confirmed tracks."""
+        return self.state == TrackState.Confirmed
+
+    def is_deleted(self):
+        """Returns a boolean mask of tracks that are dead and should be
+        deleted."""
+        return self.state == TrackState.Deleted
+
+    def remove_deleted(self):
+        """Remove all deleted tracks from the table. Remaining tracks keep
+        their relative order, but row indices (and views obtained through
+        `__getitem__`) are invalidated.
+        """
+        keep = ~self.is_deleted()
+        if keep.all():
+            return
+        self.track_id = self.track_id[keep]
+        self.state = self.state[keep]
+        self.hits = self.hits[keep]
+        self.age = self.age[keep]
+        self.time_since_update = self.time_since_update[keep]
+        self.updates_since_feature = self.updates_since_feature[keep]
+        self.mean = self.mean[keep]
+        self.covariance = self.covariance[keep]
+        self.features = [self.features[i] for i in np.flatnonzero(keep)]
+
+    def pop_features(self, rows):
+        """Take the cached features of the tracks in `rows` and clear their
+        caches.
+
+        Parameters
+        ----------
+        rows : ndarray
+            Indices of the tracks to collect features from.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the stacked features and an integer array of the track
+            identity each feature belongs to.
+
+        """
+        features, targets = [], []
+        for row in rows:
+            features += self.features[row]
+            targets += [self.track_id[row]] * len(self.features[row])
+            self.features[row] = []
+        return np.asarray(features), np.asarray(targets)
+
+    def to_tlwh(self, rows=None):
+        """Get current positions in bounding box format `(top left x, top left
+        y, width, height)`.
+
+        Parameters
+        ----------
+        rows : Optional[ndarray]
+            Indices of the tracks to convert. Defaults to all tracks.
+
+        Returns
+        -------
+        ndarray
+            The bounding boxes, one row per track.
+
+        """
+        ret = self.mean[:, :4] if rows is None else self.mean[rows, :4]
+        ret = ret.copy()
+        ret[:, 2] *= ret[:, 3]
+        ret[:, :2] -= ret[:, 2:] / 2
+        return ret
+
+    def to_tlbr(self, rows=None):
+        """Get current positions in bounding box format `(min x, miny, max x,
+        max y)`.
+
+        Parameters
+        ----------
+        rows : Optional[ndarray]
+            Indices of the tracks to convert. Defaults to all tracks.
+
+        Returns
+        -------
+        ndarray
+            The bounding boxes, one row per track.
+
+        """
+        ret = self.to_tlwh(rows)
+        ret[:, 2:] = ret[:, :2] + ret[:, 2:]
+        return ret
+
+
+def _row_property(name, cast=None):
+    """Create a property that reads and writes `table.<name>[row]` of a
+    `Track` view.
+    """
+    def getter(self):
+        value = getattr(self._table, name)[self._row]
+        return value if cast is None else cast(value)
+
+    def setter(self, value):
+        getattr(self._table, name)[self._row] = value
+    return property(getter, setter)
+
+
 class Track:
     """
     A single target track with state space `(x, y, a, h)` and associated
     velocities, where `(x, y)` is the center of the bounding box, `a` is the
     aspect ratio and `h` is the height.
 
+    The track state lives in a row of a `TrackTable`; this class is a thin view
+    onto that row. A track constructed directly owns a table with a single
+    row, whereas views obtained by indexing a `TrackTable` share the table of
+    the tracker and are valid until its next call to `remove_deleted`.
+
     Parameters
     ----------
     mean : ndarray
@@ -55,6 +371,9 @@ class Track:
         Total number of frames since first occurance.
     time_since_update : int
         Total number of frames since last measurement update.
+    updates_since_feature : int
+        Number of measurement updates since the last one that came with a
+        feature vector.
     state : TrackState
         The current track state.
     features : List[ndarray]
@@ -65,20 +384,29 @@ class Track:
 
     def __init__(self, mean, covariance, track_id, n_init, max_age,
                  feature=None):
-        self.mean = mean
-        self.covariance = covariance
-        self.track_id = track_id
-        self.hits = 1
-        self.age = 1
-        self.time_since_update = 0
-
-        self.state = TrackState.Tentative
-        self.features = []
-        if feature is not None:
-            self.features.append(feature)
+        self._table = TrackTable(n_init, max_age)
+        self._table.append(
+            np.asarray(mean)[np.newaxis], np.asarray(covariance)[np.newaxis],
+            [track_id], [feature])
+        self._row = 0
+
+    @classmethod
+    def view(cls, table, row):
+        """Create a track that refers to row `row` of `table`."""
+        track = cls.__new__(cls)
+        track._table = table
+        track._row = row
+        return track
 
-        self._n_init = n_init
-        self._max_age = max_age
+    mean = _row_property("mean")
+    covariance = _row_property("covariance")
+    features = _row_property("features")
+    track_id = _row_property("track_id", int)
+    hits = _row_property("hits", int)
+    age = _row_property("age", int)
+    time_since_update = _row_property("time_since_update", int)
+    updates_since_feature = _row_property("updates_since_feature", int)
+    state = _row_property("state", int)
 
     def to_tlwh(self):
         """Get current position in bounding box format `(top left x, top left y,
@@ -90,10 +418,7 @@ class Track:
             The bounding box.
 
         """
-        ret = self.mean[:4].copy()
-        ret[2] *= ret[3]
-        ret[:2] -= ret[2:] / 2
-        return ret
+        return self._table.to_tlwh([self._row])[0]
 
     def to_tlbr(self):
         """Get current position in bounding box format `(min x, miny, max x,
@@ -105,9 +430,7 @@ class Track:
             The bounding box.
 
         """
-        ret = self.to_tlwh()
-        ret[2:] = ret[:2] + ret[2:]
-        return ret
+        return self._table.to_tlbr([self._row])[0]
 
     def predict(self, kf):
         """Propagate the state distribution to the current time step using a
@@ -119,9 +442,21 @@ class Track:
             The Kalman filter.
 
         """
-        self.mean, self.covariance = kf.predict(self.mean, self.covariance)
-        self.age += 1
-        self.time_since_update += 1
+        self.apply_prediction(*kf.predict(self.mean, self.covariance))
+
+    def apply_prediction(self, mean, covariance):
+        """Set the predicted state distribution of this track, e.g., as computed
+        by `KalmanFilter.predict_batch` for many tracks at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The predicted mean vector (8 dimensional).
+        covariance : ndarray
+            The predicted covariance matrix (8x8 dimensional).
+
+        """
+        self._table.apply_prediction([self._row], mean, covariance)
 
     def update(self, kf, detection):
         """Perform Kalman filter measurement update step and update the feature
@@ -135,22 +470,32 @@ class Track:
             The associated detection.
 
         """
-        self.mean, self.covariance = kf.update(
+        mean, covariance = kf.update(
             self.mean, self.covariance, detection.to_xyah())
-        self.features.append(detection.feature)
+        self.apply_update(mean, covariance, detection)
 
-        self.hits += 1
-        self.time_since_update = 0
-        if self.state == TrackState.Tentative and self.hits >= self._n_init:
-            self.state = TrackState.Confirmed
+    def apply_update(self, mean, covariance, detection):
+        """Set the measurement-corrected state distribution of this track, e.g.,
+        as computed by `KalmanFilter.update_batch`, and update the feature
+        cache.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The corrected mean vector (8 dimensional).
+        covariance : ndarray
+            The corrected covariance matrix (8x8 dimensional).
+        detection : Detection
+            The associated detection.
+
+        """
+        self._table.apply_update(
+            [self._row], mean, covariance, [detection.feature])
 
     def mark_missed(self):
         """Mark this track as missed (no association at the current time step).
         """
-        if self.state == TrackState.Tentative:
-            self.state = TrackState.Deleted
-        elif self.time_since_update > self._max_age:
-            self.state = TrackState.Deleted
+        self._table.mark_missed([self._row])
 
     def is_tentative(self):
         """Returns True if this track is tentative (unconfirmed).
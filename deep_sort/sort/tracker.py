@@ -4,7 +4,8 @@ import numpy as np
 from . import kalman_filter
 from . import linear_assignment
 from . import iou_matching
-from .track import Track
+from .spatial_index import GridIndex
+from .track import TrackTable
 
 
 class Tracker:
@@ -21,6 +22,27 @@ class Tracker:
         Number of consecutive detections before the track is confirmed. The
         track state is set to `Deleted` if a miss occurs within the first
         `n_init` frames.
+    assignment_solver : str
+        Name of the linear assignment solver, see `linear_assignment.solve`.
+        Defaults to `scipy`, which keeps the track ids of the original
+        implementation.
+    decompose_assignment : bool
+        If True, large assignment problems are split into the connected
+        components of their feasible pairs, see `linear_assignment.solve`.
+        May change the ids of new tracks.
+    grid_cell_size : Optional[float]
+        If not None, the gating regions of the tracks are kept in a spatial
+        grid index with cells of this size (in pixels) and appearance and
+        gating costs are only evaluated for detections inside of a track's
+        gating region. Worthwhile with hundreds of tracks per frame.
+    lazy_iou : Optional[float]
+        If not None, `preassociate` accepts confirmed tracks whose association
+        is unambiguous and whose predicted box overlaps their detection with
+        an IoU above this value, so that the detection need not be embedded.
+        New tracks may be numbered differently than without it.
+    feature_refresh_interval : int
+        A track may skip at most `feature_refresh_interval - 1` feature
+        vectors in a row through `preassociate`.
 
     Attributes
     ----------
@@ -32,107 +54,273 @@ class Tracker:
         Number of frames that a track remains in initialization phase.
     kf : kalman_filter.KalmanFilter
         A Kalman filter to filter target trajectories in image space.
+    table : TrackTable
+        The active tracks at the current time step.
+    index : GridIndex | NoneType
+        The spatial index over the gating regions of `table`, refreshed in
+        `predict`. None if disabled.
     tracks : List[Track]
-        The list of active tracks at the current time step.
+        Views onto the rows of `table`, valid until the next call to
+        `update`.
+    stats : Dict[str -> int]
+        Counters of the last call to `update`. `cascade_levels` is the number
+        of matching cascade levels that were solved and
+        `cost_evaluations_saved` the number of per-level appearance and
+        gating evaluations that were served from the frame's cost matrix.
+        With the spatial index, `candidate_pairs` is the number of track and
+        detection pairs that passed the gate. `prematched` is the number of
+        associations given to `update` by `preassociate`.
 
     """
 
-    def __init__(self, metric, max_iou_distance=0.7, max_age=70, n_init=3):
+    def __init__(self, metric, max_iou_distance=0.7, max_age=70, n_init=3,
+                 assignment_solver="scipy", grid_cell_size=None, lazy_iou=None,
+                 feature_refresh_interval=10, decompose_assignment=False):
         self.metric = metric
         self.max_iou_distance = max_iou_distance
         self.max_age = max_age
         self.n_init = n_init
+        self.assignment_solver = assignment_solver
+        self.decompose_assignment = decompose_assignment
+        self.lazy_iou = lazy_iou
+        self.feature_refresh_interval = feature_refresh_interval
 
         self.kf = kalman_filter.KalmanFilter()
-        self.tracks = []
+        self.table = TrackTable(n_init, max_age)
+        self.index = GridIndex(grid_cell_size) if grid_cell_size else None
+        self.stats = {}
         self._next_id = 1
 
+    @property
+    def tracks(self):
+        return list(self.table)
+
     def predict(self):
         """Propagate track state distributions one time step forward.
 
         This function should be called once every time step, before `update`.
         """
-        for track in self.tracks:
-            track.predict(self.kf)
+        self.table.predict(self.kf)
+        if self.index is not None:
+            self._update_index()
+
+    def _update_index(self):
+        lower, upper = self.kf.gating_rectangles(
+            self.table.mean, self.table.covariance)
+        self.index.update(self.table.track_id, lower, upper)
+
+    def preassociate(self, detections):
+        """Find associations that `update` is certain to make regardless of
+        appearance, so that their detections need not be embedded.
+
+        A confirmed track that was updated in the previous frame is associated
+        with a detection if the detection is the only one inside of the
+        track's gate, the track is the only confirmed track whose gate
+        contains the detection, neither has another partner within the IoU
+        matching threshold, and their IoU exceeds `lazy_iou`. Such a pair is
+        matched by the appearance cascade or, failing that, by the IoU stage.
+        Tracks that skipped `feature_refresh_interval - 1` feature vectors in
+        a row are not pre-associated.
+
+        The pre-associated pairs are left out of the assignment problems of
+        `update`. The matches stay the same, but the solver may then leave
+        different gate-rejected pairs unassigned, which changes the order of
+        the unmatched detections and so the ids given to new tracks.
+
+        This function must be called after `predict` and before `update`.
+
+        Parameters
+        ----------
+        detections : List[deep_sort.detection.Detection]
+            A list of detections at the current time step. Features are not
+            required.
+
+        Returns
+        -------
+        ndarray
+            A Kx2 integer array of track (row in `table`) and detection
+            indices, to be passed to `update`. Empty if `lazy_iou` is None.
+
+        """
+        prematched = np.zeros((0, 2), dtype=np.int64)
+        if self.lazy_iou is None or len(detections) == 0 \
+                or len(self.table) == 0:
+            return prematched
 
-    def update(self, detections):
+        # Feasible pairs of the appearance cascade.
+        confirmed_tracks = np.flatnonzero(self.table.is_confirmed())
+        measurements = np.asarray([d.to_xyah() for d in detections])
+        if self.index is not None:
+            if not np.array_equal(self.index.keys, self.table.track_id):
+                self._update_index()
+            rows, cols = self.index.query(measurements[:, :2])
+            is_candidate = self.table.is_confirmed()[rows]
+            rows, cols = rows[is_candidate], cols[is_candidate]
+            gating_distance = self.kf.gating_distance_pairs(
+                self.table.mean, self.table.covariance, measurements,
+                rows, cols)
+        else:
+            gating_distance = linear_assignment.gating_distance_matrix(
+                self.kf, self.table, detections, confirmed_tracks)
+            rows = np.repeat(confirmed_tracks, len(detections))
+            cols = np.tile(np.arange(len(detections)), len(confirmed_tracks))
+            gating_distance = gating_distance.ravel()
+        is_feasible = gating_distance <= kalman_filter.chi2inv95[4]
+        rows, cols = rows[is_feasible], cols[is_feasible]
+        gate_count_track = np.bincount(rows, minlength=len(self.table))
+        gate_count_detection = np.bincount(cols, minlength=len(detections))
+
+        # Feasible pairs of the IoU stage, with all tracks as candidates.
+        iou = iou_matching.iou_matrix(
+            self.table.to_tlwh(), np.asarray([d.tlwh for d in detections]))
+        overlaps = 1. - iou <= self.max_iou_distance
+
+        is_unique = (
+            (gate_count_track[rows] == 1) & (gate_count_detection[cols] == 1)
+            & (overlaps.sum(axis=1)[rows] == 1)
+            & (overlaps.sum(axis=0)[cols] == 1)
+            & (iou[rows, cols] > self.lazy_iou)
+            & (self.table.time_since_update[rows] == 1)
+            & (self.table.updates_since_feature[rows] + 1
+               < self.feature_refresh_interval))
+        return np.stack((rows[is_unique], cols[is_unique]), axis=1)
+
+    def update(self, detections, prematched=None):
         """Perform measurement update and track management.
 
         Parameters
         ----------
         detections : List[deep_sort.detection.Detection]
             A list of detections at the current time step.
+        prematched : Optional[ndarray]
+            A Kx2 integer array of track and detection indices that are
+            associated without matching, as returned by `preassociate`. The
+            features of these detections may be None.
 
         """
+        self.stats = {"cascade_levels": 0, "cost_evaluations_saved": 0}
+        if prematched is None:
+            prematched = np.zeros((0, 2), dtype=np.int64)
+        self.stats["prematched"] = len(prematched)
+
         # Run matching cascade.
         matches, unmatched_tracks, unmatched_detections = \
-            self._match(detections)
+            self._match(detections, prematched)
 
         # Update track set.
-        for track_idx, detection_idx in matches:
-            self.tracks[track_idx].update(
-                self.kf, detections[detection_idx])
-        for track_idx in unmatched_tracks:
-            self.tracks[track_idx].mark_missed()
-        for detection_idx in unmatched_detections:
-            self._initiate_track(detections[detection_idx])
-        self.tracks = [t for t in self.tracks if not t.is_deleted()]
+        if len(matches) > 0:
+            track_rows, detection_rows = matches[:, 0], matches[:, 1]
+            self.table.update(
+                self.kf, track_rows,
+                np.asarray([detections[i].to_xyah() for i in detection_rows]),
+                [detections[i].feature for i in detection_rows])
+        self.table.mark_missed(unmatched_tracks)
+        self._initiate_tracks([detections[i] for i in unmatched_detections])
+        self.table.remove_deleted()
 
         # Update distance metric.
-        active_targets = [t.track_id for t in self.tracks if t.is_confirmed()]
-        features, targets = [], []
-        for track in self.tracks:
-            if not track.is_confirmed():
-                continue
-            features += track.features
-            targets += [track.track_id for _ in track.features]
-            track.features = []
-        self.metric.partial_fit(
-            np.asarray(features), np.asarray(targets), active_targets)
-
-    def _match(self, detections):
+        confirmed = self.table.is_confirmed()
+        active_targets = self.table.track_id[confirmed]
+        features, targets = self.table.pop_features(np.flatnonzero(confirmed))
+        self.metric.partial_fit(features, targets, active_targets)
+
+    def _match(self, detections, prematched):
 
         def gated_metric(tracks, dets, track_indices, detection_indices):
-            features = np.array([dets[i].feature for i in detection_indices])
-            targets = np.array([tracks[i].track_id for i in track_indices])
-            cost_matrix = self.metric.distance(features, targets)
-            cost_matrix = linear_assignment.gate_cost_matrix(
-                self.kf, cost_matrix, tracks, dets, track_indices,
-                detection_indices)
+            self.stats["cascade_levels"] += 1
+            return cost_matrix[np.ix_(
+                track_rows[track_indices], detection_cols[detection_indices])]
 
-            return cost_matrix
+        # Split track set into confirmed and unconfirmed tracks, leaving out
+        # pre-associated tracks and detections.
+        is_confirmed = self.table.is_confirmed()
+        is_free = np.ones(len(self.table), dtype=bool)
+        is_free[prematched[:, 0]] = False
+        confirmed_tracks = np.flatnonzero(is_confirmed & is_free)
+        unconfirmed_tracks = np.flatnonzero(~is_confirmed)
+        free_detections = np.setdiff1d(
+            np.arange(len(detections)), prematched[:, 1])
 
-        # Split track set into confirmed and unconfirmed tracks.
-        confirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if t.is_confirmed()]
-        unconfirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if not t.is_confirmed()]
+        # Build the gated appearance cost of all confirmed tracks once per
+        # frame; each cascade level slices the (tracks x detections) matrix.
+        track_rows = np.zeros(len(self.table), dtype=np.int64)
+        track_rows[confirmed_tracks] = np.arange(len(confirmed_tracks))
+        detection_cols = np.zeros(len(detections), dtype=np.int64)
+        detection_cols[free_detections] = np.arange(len(free_detections))
+        features = np.array(
+            [detections[i].feature for i in free_detections])
+        if self.index is None:
+            cost_matrix = self.metric.distance(
+                features, self.table.track_id[confirmed_tracks])
+            cost_matrix = linear_assignment.gate_cost_matrix(
+                self.kf, cost_matrix, self.table, detections,
+                confirmed_tracks, free_detections)
+        else:
+            cost_matrix = self._indexed_cost_matrix(
+                [detections[i] for i in free_detections], features,
+                confirmed_tracks, track_rows)
 
         # Associate confirmed tracks using appearance features.
         matches_a, unmatched_tracks_a, unmatched_detections = \
             linear_assignment.matching_cascade(
                 gated_metric, self.metric.matching_threshold, self.max_age,
-                self.tracks, detections, confirmed_tracks)
+                self.table, detections, confirmed_tracks, free_detections,
+                solver=self.assignment_solver,
+                decompose=self.decompose_assignment)
 
         # Associate remaining tracks together with unconfirmed tracks using IOU.
-        iou_track_candidates = unconfirmed_tracks + [
-            k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update == 1]
-        unmatched_tracks_a = [
-            k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update != 1]
+        recently_updated = \
+            self.table.time_since_update[unmatched_tracks_a] == 1
+        iou_track_candidates = np.r_[
+            unconfirmed_tracks, unmatched_tracks_a[recently_updated]]
+        unmatched_tracks_a = unmatched_tracks_a[~recently_updated]
         matches_b, unmatched_tracks_b, unmatched_detections = \
             linear_assignment.min_cost_matching(
-                iou_matching.iou_cost, self.max_iou_distance, self.tracks,
-                detections, iou_track_candidates, unmatched_detections)
+                iou_matching.iou_cost, self.max_iou_distance, self.table,
+                detections, iou_track_candidates, unmatched_detections,
+                solver=self.assignment_solver,
+                decompose=self.decompose_assignment)
 
-        matches = matches_a + matches_b
-        unmatched_tracks = list(set(unmatched_tracks_a + unmatched_tracks_b))
+        matches = np.concatenate((prematched, matches_a, matches_b), axis=0)
+        unmatched_tracks = np.r_[unmatched_tracks_a, unmatched_tracks_b]
+        self.stats["cost_evaluations_saved"] = max(
+            self.stats["cascade_levels"] - 1, 0)
         return matches, unmatched_tracks, unmatched_detections
 
-    def _initiate_track(self, detection):
-        mean, covariance = self.kf.initiate(detection.to_xyah())
-        self.tracks.append(Track(
-            mean, covariance, self._next_id, self.n_init, self.max_age,
-            detection.feature))
-        self._next_id += 1
+    def _indexed_cost_matrix(self, detections, features, confirmed_tracks,
+                             track_rows):
+        # Same as the dense gated cost matrix, but appearance and gating
+        # distances are only computed for detections inside of the
+        # conservative gating rectangle of a track.
+        if not np.array_equal(self.index.keys, self.table.track_id):
+            self._update_index()
+        cost_matrix = np.full(
+            (len(confirmed_tracks), len(detections)),
+            linear_assignment.INFTY_COST)
+        if len(detections) == 0:
+            return cost_matrix
+        measurements = np.asarray([d.to_xyah() for d in detections])
+        rows, cols = self.index.query(measurements[:, :2])
+        is_candidate = self.table.is_confirmed()[rows]
+        rows, cols = rows[is_candidate], cols[is_candidate]
+
+        gating_distance = self.kf.gating_distance_pairs(
+            self.table.mean, self.table.covariance, measurements, rows, cols)
+        is_feasible = gating_distance <= kalman_filter.chi2inv95[4]
+        rows, cols = rows[is_feasible], cols[is_feasible]
+
+        cost_matrix[track_rows[rows], cols] = self.metric.pair_distance(
+            features, self.table.track_id, rows, cols)
+        self.stats["candidate_pairs"] = len(rows)
+        return cost_matrix
+
+    def _initiate_tracks(self, detections):
+        if len(detections) == 0:
+            return
+        means, covariances = zip(
+            *[self.kf.initiate(d.to_xyah()) for d in detections])
+        track_ids = np.arange(self._next_id, self._next_id + len(detections))
+        self.table.append(
+            np.asarray(means), np.asarray(covariances), track_ids,
+            [d.feature for d in detections])
+        self._next_id += len(detections)
@@ -38,8 +38,9 @@ class Sharingan(object):
             cv2.resizeWindow("test", args.display_width, args.display_height)
 
         self.vdo = cv2.VideoCapture()
-        self.detector = build_detector(cfg, use_cuda=use_cuda)
-        self.deepsort = build_tracker(cfg, use_cuda=use_cuda)
+        # both take BGR frames from OpenCV and convert the resized images
+        self.detector = build_detector(cfg, use_cuda=use_cuda, bgr=True)
+        self.deepsort = build_tracker(cfg, use_cuda=use_cuda, bgr=True)
         self.class_names = self.detector.class_names
 
     def __enter__(self):
@@ -124,11 +125,8 @@ class Sharingan(object):
             """
             fg_im = fixed_im
             
-            # convert to rgb
-            fg_im_rgb = cv2.cvtColor(fg_im, cv2.COLOR_BGR2RGB)
-
             # do detection
-            bbox_xywh, cls_conf, cls_ids = self.detector(fg_im_rgb)
+            bbox_xywh, cls_conf, cls_ids = self.detector(fg_im)
 
             # select traffic class
             mask = False
@@ -140,7 +138,7 @@ class Sharingan(object):
             cls_conf = cls_conf[mask]
 
             # do tracking
-            outputs = self.deepsort.update(bbox_xywh, cls_conf, fg_im_rgb)
+            outputs = self.deepsort.update(bbox_xywh, cls_conf, fg_im)
 
             # draw boxes for visualization
             if len(outputs) > 0:
@@ -211,6 +209,9 @@ if __name__ == "__main__":
     else:
         cfg.merge_from_file(args.config_detection)
         cfg.USE_MMDET = False
+        if not cfg.YOLOV3.get("CLASS_WHITELIST"):
+            # only cars, buses and trucks are counted, drop the other classes before nms
+            cfg.YOLOV3.CLASS_WHITELIST = [2, 5, 7]
     cfg.merge_from_file(args.config_deepsort)
     if args.fastreid:
         cfg.merge_from_file(args.config_fastreid)
@@ -39,8 +39,9 @@ class VideoTracker(object):
             self.vdo = cv2.VideoCapture(args.cam)
         else:
             self.vdo = cv2.VideoCapture()
-        self.detector = build_detector(cfg, use_cuda=use_cuda)
-        self.deepsort = build_tracker(cfg, use_cuda=use_cuda)
+        # both take BGR frames from OpenCV and convert the resized images
+        self.detector = build_detector(cfg, use_cuda=use_cuda, bgr=True)
+        self.deepsort = build_tracker(cfg, use_cuda=use_cuda, bgr=True)
         self.class_names = self.detector.class_names
 
     def __enter__(self):
@@ -78,6 +79,10 @@ class VideoTracker(object):
             print(exc_type, exc_value, exc_traceback)
 
     def run(self):
+        if self.args.lookahead > 1:
+            return self.run_lookahead()
+        if self.args.async_reid:
+            return self.run_async()
         results = []
         idx_frame = 0
         while self.vdo.grab():
@@ -87,49 +92,115 @@ class VideoTracker(object):
 
             start = time.time()
             _, ori_im = self.vdo.retrieve()
-            im = cv2.cvtColor(ori_im, cv2.COLOR_BGR2RGB)
 
             # do detection
-            bbox_xywh, cls_conf, cls_ids = self.detector(im)
-
-            # select person class
-            mask = cls_ids == 0
-
-            bbox_xywh = bbox_xywh[mask]
-            # bbox dilation just in case bbox too small, delete this line if using a better pedestrian detector
-            bbox_xywh[:, 3:] *= 1.2
-            cls_conf = cls_conf[mask]
+            bbox_xywh, cls_conf = self.detect(ori_im)
 
             # do tracking
-            outputs = self.deepsort.update(bbox_xywh, cls_conf, im)
-
-            # draw boxes for visualization
-            if len(outputs) > 0:
-                bbox_tlwh = []
-                bbox_xyxy = outputs[:, :4]
-                identities = outputs[:, -1]
-                ori_im = draw_boxes(ori_im, bbox_xyxy, identities)
-
-                for bb_xyxy in bbox_xyxy:
-                    bbox_tlwh.append(self.deepsort._xyxy_to_tlwh(bb_xyxy))
-
-                results.append((idx_frame - 1, bbox_tlwh, identities))
-
-            end = time.time()
+            outputs = self.deepsort.update(bbox_xywh, cls_conf, ori_im)
+            self.finish_frame(idx_frame, ori_im, bbox_xywh, outputs, results, start)
+
+    def run_async(self):
+        """
+        Pipelined variant of `run`: the ReID forward of frame t runs on the
+        tracker's worker thread while the detector processes frame t+1, and
+        frames are associated strictly in order one frame behind.
+        """
+        results = []
+        idx_frame = 0
+        pending = None
+        start = time.time()
+        while self.vdo.grab():
+            idx_frame += 1
+            if idx_frame % self.args.frame_interval:
+                continue
 
-            if self.args.display:
-                cv2.imshow("test", ori_im)
-                cv2.waitKey(1)
+            _, ori_im = self.vdo.retrieve()
+            bbox_xywh, cls_conf = self.detect(ori_im)
+            self.deepsort.submit_features(idx_frame, bbox_xywh, ori_im, cls_conf)
+
+            if pending is not None:
+                start = self.finish_pending(pending, results, start)
+            pending = (idx_frame, ori_im, bbox_xywh, cls_conf)
+
+        if pending is not None:
+            self.finish_pending(pending, results, start)
+
+    def run_lookahead(self):
+        """
+        Offline variant of `run`: detections of `--lookahead` frames are
+        buffered, the crops of the whole window are embedded in a few large
+        batches, and then the frames are tracked one by one with the
+        precomputed features. The output is the same as with `run`.
+        """
+        results = []
+        idx_frame = 0
+        window = []
+        start = time.time()
+        while True:
+            grabbed = self.vdo.grab()
+            if grabbed:
+                idx_frame += 1
+                if idx_frame % self.args.frame_interval:
+                    continue
+                _, ori_im = self.vdo.retrieve()
+                bbox_xywh, cls_conf = self.detect(ori_im)
+                window.append((idx_frame, ori_im, bbox_xywh, cls_conf))
+            if window and (len(window) == self.args.lookahead or not grabbed):
+                frame_ids, ori_ims, bbox_xywhs, cls_confs = zip(*window)
+                self.deepsort.precompute_features(frame_ids, bbox_xywhs, ori_ims, cls_confs)
+                for pending in window:
+                    start = self.finish_pending(pending, results, start)
+                window = []
+            if not grabbed:
+                break
+
+    def finish_pending(self, pending, results, start):
+        idx_frame, ori_im, bbox_xywh, cls_conf = pending
+        outputs = self.deepsort.update(bbox_xywh, cls_conf, ori_im, frame_id=idx_frame)
+        self.finish_frame(idx_frame, ori_im, bbox_xywh, outputs, results, start)
+        return time.time()
+
+    def detect(self, im):
+        bbox_xywh, cls_conf, cls_ids = self.detector(im)
+
+        # select person class
+        mask = cls_ids == 0
+
+        bbox_xywh = bbox_xywh[mask]
+        # bbox dilation just in case bbox too small, delete this line if using a better pedestrian detector
+        bbox_xywh[:, 3:] *= 1.2
+        cls_conf = cls_conf[mask]
+        return bbox_xywh, cls_conf
+
+    def finish_frame(self, idx_frame, ori_im, bbox_xywh, outputs, results, start):
+        # draw boxes for visualization
+        if len(outputs) > 0:
+            bbox_tlwh = []
+            bbox_xyxy = outputs[:, :4]
+            identities = outputs[:, -1]
+            ori_im = draw_boxes(ori_im, bbox_xyxy, identities)
+
+            for bb_xyxy in bbox_xyxy:
+                bbox_tlwh.append(self.deepsort._xyxy_to_tlwh(bb_xyxy))
+
+            results.append((idx_frame - 1, bbox_tlwh, identities))
+
+        end = time.time()
+
+        if self.args.display:
+            cv2.imshow("test", ori_im)
+            cv2.waitKey(1)
 
-            if self.args.save_path:
-                self.writer.write(ori_im)
+        if self.args.save_path:
+            self.writer.write(ori_im)
 
-            # save results
-            write_results(self.save_results_path, results, 'mot')
+        # save results
+        write_results(self.save_results_path, results, 'mot')
 
-            # logging
-            self.logger.info("time: {:.03f}s, fps: {:.03f}, detection numbers: {}, tracking numbers: {}" \
-                             .format(end - start, 1 / (end - start), bbox_xywh.shape[0], len(outputs)))
+        # logging
+        self.logger.info("time: {:.03f}s, fps: {:.03f}, detection numbers: {}, tracking numbers: {}" \
+                         .format(end - start, 1 / (end - start), bbox_xywh.shape[0], len(outputs)))
 
 
 def parse_args():
@@ -149,6 +220,10 @@ def parse_args():
     parser.add_argument("--save_path", type=str, default="./output/")
     parser.add_argument("--cpu", dest="use_cuda", action="store_false", default=True)
     parser.add_argument("--camera", action="store", dest="cam", type=int, default="-1")
+    parser.add_argument("--async_reid", action="store_true",
+                        help="overlap the ReID forward of a frame with the detection of the next one")
+    parser.add_argument("--lookahead", type=int, default=1,
+                        help="offline files only: embed the crops of this many frames together")
     return parser.parse_args()
 
 
@@ -161,6 +236,9 @@ if __name__ == "__main__":
     else:
         cfg.merge_from_file(args.config_detection)
         cfg.USE_MMDET = False
+        if not cfg.YOLOV3.get("CLASS_WHITELIST"):
+            # only persons are tracked, drop the other classes before nms
+            cfg.YOLOV3.CLASS_WHITELIST = [0]
     cfg.merge_from_file(args.config_deepsort)
     if args.fastreid:
         cfg.merge_from_file(args.config_fastreid)
@@ -7,7 +7,7 @@ import torch
 
 class MMDet(object):
     def __init__(self, cfg_file, checkpoint_file, score_thresh=0.7,
-                is_xywh=False, use_cuda=True):
+                is_xywh=False, use_cuda=True, bgr=False):
         # net definition
         self.device = "cuda" if use_cuda else "cpu"
         self.net = init_detector(cfg_file, checkpoint_file, device=self.device)
@@ -18,10 +18,14 @@ class MMDet(object):
         self.score_thresh = score_thresh
         self.use_cuda = use_cuda
         self.is_xywh = is_xywh
+        self.bgr = bgr
         self.class_names = self.net.CLASSES
         self.num_classes = len(self.class_names)
 
     def __call__(self, ori_img):
+        if self.bgr:
+            # the tracker feeds RGB frames, keep doing so for BGR input
+            ori_img = ori_img[:, :, ::-1]
         # forward
         bbox_result = inference_detector(self.net, ori_img)
         bboxes = np.vstack(bbox_result)
@@ -10,7 +10,7 @@ from .nms import boxes_nms
 
 class YOLOv3(object):
     def __init__(self, cfgfile, weightfile, namesfile, score_thresh=0.7, conf_thresh=0.01, nms_thresh=0.45,
-                 is_xywh=False, use_cuda=True):
+                 is_xywh=False, use_cuda=True, letterbox=False, bgr=False, class_ids=None):
         # net definition
         self.net = Darknet(cfgfile)
         self.net.load_weights(weightfile)
@@ -29,21 +29,64 @@ class YOLOv3(object):
         self.is_xywh = is_xywh
         self.num_classes = self.net.num_classes
         self.class_names = self.load_class_names(namesfile)
+        # whitelist of class ids, the others are dropped while decoding
+        self.class_ids = class_ids
+
+        # preprocessing: frames are resized in uint8 (optionally letterboxed
+        # to keep the aspect ratio, and converted from BGR if `bgr`) into a
+        # reused canvas, then copied into a preallocated float32 input
+        self.letterbox = letterbox
+        self.bgr = bgr
+        self._canvas = np.full((self.size[1], self.size[0], 3), 128, dtype=np.uint8)
+        self._input = torch.empty((1, 3, self.size[1], self.size[0]), device=self.device)
+        self._frame_shape = None
+
+    def _update_affine(self, height, width):
+        """
+        Compute the placement of a `height` x `width` frame in the network
+        input and the affine map of normalized network coordinates back to
+        frame pixels, once per frame size.
+        """
+        net_w, net_h = self.size
+        if self.letterbox:
+            scale = min(net_w / width, net_h / height)
+            new_w, new_h = int(round(width * scale)), int(round(height * scale))
+            left, top = (net_w - new_w) // 2, (net_h - new_h) // 2
+            self._canvas[:] = 128
+        else:
+            new_w, new_h, left, top = net_w, net_h, 0, 0
+        self._region = (slice(top, top + new_h), slice(left, left + new_w))
+        # frame = normalized * gain - offset, per x / y
+        gain_x, gain_y = width * net_w / new_w, height * net_h / new_h
+        offset_x, offset_y = left * width / new_w, top * height / new_h
+        self._gain = torch.FloatTensor([[gain_x, gain_y, gain_x, gain_y]])
+        if self.is_xywh:
+            self._offset = torch.FloatTensor([[offset_x, offset_y, 0., 0.]])
+        else:
+            self._offset = torch.FloatTensor([[offset_x, offset_y, offset_x, offset_y]])
+        self._frame_shape = (height, width)
+
+    def _preprocess(self, ori_img):
+        height, width = ori_img.shape[:2]
+        if self._frame_shape != (height, width):
+            self._update_affine(height, width)
+        region = self._canvas[self._region]
+        cv2.resize(ori_img, (region.shape[1], region.shape[0]), dst=region)
+        if self.bgr:
+            cv2.cvtColor(region, cv2.COLOR_BGR2RGB, dst=region)
+        self._input[0].copy_(torch.from_numpy(self._canvas).permute(2, 0, 1))
+        return self._input.div_(255.)
 
     def __call__(self, ori_img):
         # img to tensor
         assert isinstance(ori_img, np.ndarray), "input must be a numpy array!"
-        img = ori_img.astype(np.float) / 255.
-
-        img = cv2.resize(img, self.size)
-        img = torch.from_numpy(img).float().permute(2, 0, 1).unsqueeze(0)
+        img = self._preprocess(ori_img)
 
         # forward
         with torch.no_grad():
-            img = img.to(self.device)
             out_boxes = self.net(img)
             boxes = get_all_boxes(out_boxes, self.conf_thresh, self.num_classes,
-                                  use_cuda=self.use_cuda)  # batch size is 1
+                                  use_cuda=self.use_cuda, class_ids=self.class_ids)  # batch size is 1
             # boxes = nms(boxes, self.nms_thresh)
 
             boxes = post_process(boxes, self.net.num_classes, self.conf_thresh, self.nms_thresh)[0].cpu()
@@ -54,13 +97,14 @@ class YOLOv3(object):
             cls_conf = torch.FloatTensor([])
             cls_ids = torch.LongTensor([])
         else:
-            height, width = ori_img.shape[:2]
             bbox = boxes[:, :4]
             if self.is_xywh:
                 # bbox x y w h
                 bbox = xyxy_to_xywh(bbox)
 
-            bbox *= torch.FloatTensor([[width, height, width, height]])
+            bbox *= self._gain
+            if self.letterbox:
+                bbox -= self._offset
             cls_conf = boxes[:, 5]
             cls_ids = boxes[:, 6].long()
         return bbox.numpy(), cls_conf.numpy(), cls_ids.numpy()
@@ -1 +1 @@
-from .nms import boxes_nms
\ No newline at end of file
+from .nms import boxes_nms, batched_boxes_nms
\ No newline at end of file
@@ -7,7 +7,8 @@ try:
 
     _nms = torch_extension.nms
 except ImportError:
-    if torchvision.__version__ >= '0.3.0':
+    # torchvision >= 0.3.0; comparing version strings misorders 0.10 and up
+    if hasattr(torchvision, 'ops') and hasattr(torchvision.ops, 'nms'):
         _nms = torchvision.ops.nms
     else:
         from .python_nms import python_nms
@@ -32,3 +33,21 @@ def boxes_nms(boxes, scores, nms_thresh, max_count=-1):
     if max_count > 0:
         keep = keep[:max_count]
     return keep
+
+
+def batched_boxes_nms(boxes, scores, idxs, nms_thresh):
+    """ Performs non-maximum suppression independently per category in a
+    single call, as `torchvision.ops.batched_nms`: the boxes of each category
+    are offset so that boxes of different categories never overlap.
+    Args:
+        boxes(Tensor): `xyxy` mode boxes, use absolute coordinates(or relative coordinates), shape is (n, 4)
+        scores(Tensor): scores, shape is (n, )
+        idxs(Tensor): category of each box, shape is (n, )
+        nms_thresh(float): thresh
+    Returns:
+        indices kept.
+    """
+    if boxes.numel() == 0:
+        return torch.empty((0,), dtype=torch.long, device=boxes.device)
+    offsets = idxs.to(boxes) * (boxes.max() + 1)
+    return _nms(boxes + offsets[:, None], scores, nms_thresh)
@@ -78,28 +78,24 @@ def multi_bbox_ious(boxes1, boxes2, x1y1x2y2=True):
     return carea / uarea
 
 
-from .nms import boxes_nms
+from .nms import batched_boxes_nms
 
 
 def post_process(boxes, num_classes, conf_thresh=0.01, nms_thresh=0.45, obj_thresh=0.3):
     batch_size = boxes.size(0)
 
-    # nms
+    # class-aware nms, a single call per image with boxes offset by class id
     results_boxes = []
     for batch_id in range(batch_size):
-        processed_boxes = []
-        for cls_id in range(num_classes):
-            mask = (boxes[batch_id, :, -1] == cls_id) * (boxes[batch_id, :, 4] > obj_thresh)
-            masked_boxes = boxes[batch_id, mask]
+        candidates = boxes[batch_id, boxes[batch_id, :, 4] > obj_thresh]
+        cls_ids = candidates[:, -1].long()
 
-            keep = boxes_nms(masked_boxes[:, :4], masked_boxes[:, 5], nms_thresh)
+        keep = batched_boxes_nms(candidates[:, :4], candidates[:, 5], cls_ids, nms_thresh)
+        # grouped by class id, in increasing order (a stable sort of the ids)
+        rank = torch.arange(len(keep), device=keep.device)
+        keep = keep[torch.sort(cls_ids[keep] * len(keep) + rank)[1]]
 
-            nmsed_boxes = masked_boxes[keep, :]
-
-            processed_boxes.append(nmsed_boxes)
-        processed_boxes = torch.cat(processed_boxes, dim=0)
-
-    results_boxes.append(processed_boxes)
+        results_boxes.append(candidates[keep, :])
 
     return results_boxes
 
@@ -158,7 +154,7 @@ def convert2cpu_long(gpu_matrix):
     return torch.LongTensor(gpu_matrix.size()).copy_(gpu_matrix)
 
 
-def get_all_boxes(output, conf_thresh, num_classes, only_objectness=1, validation=False, use_cuda=True):
+def get_all_boxes(output, conf_thresh, num_classes, only_objectness=1, validation=False, use_cuda=True, class_ids=None):
     # total number of inputs (batch size)
     # first element (x) for first tuple (x, anchor_mask, num_anchor)
     batchsize = output[0]['x'].data.size(0)
@@ -167,14 +163,15 @@ def get_all_boxes(output, conf_thresh, num_classes, only_objectness=1, validatio
     for i in range(len(output)):
         pred, anchors, num_anchors = output[i]['x'].data, output[i]['a'], output[i]['n'].item()
         boxes = get_region_boxes(pred, conf_thresh, num_classes, anchors, num_anchors, \
-                                 only_objectness=only_objectness, validation=validation, use_cuda=use_cuda)
+                                 only_objectness=only_objectness, validation=validation, use_cuda=use_cuda,
+                                 class_ids=class_ids)
 
         all_boxes.append(boxes)
     return torch.cat(all_boxes, dim=1)
 
 
 def get_region_boxes(output, obj_thresh, num_classes, anchors, num_anchors, only_objectness=1, validation=False,
-                     use_cuda=True):
+                     use_cuda=True, class_ids=None):
     device = torch.device("cuda" if use_cuda else "cpu")
     anchors = anchors.to(device)
     anchor_step = anchors.size(0) // num_anchors
@@ -184,38 +181,43 @@ def get_region_boxes(output, obj_thresh, num_classes, anchors, num_anchors, only
     assert (output.size(1) == (5 + num_classes) * num_anchors)
     h = output.size(2)
     w = output.size(3)
-    cls_anchor_dim = batch * num_anchors * h * w
 
-    # all_boxes = []
-    output = output.view(batch * num_anchors, 5 + num_classes, h * w).transpose(0, 1).contiguous().view(5 + num_classes,
-                                                                                                        cls_anchor_dim)
+    output = output.view(batch, num_anchors, 5 + num_classes, h * w)
 
-    grid_x = torch.linspace(0, w - 1, w).repeat(batch * num_anchors, h, 1).view(cls_anchor_dim).to(device)
-    grid_y = torch.linspace(0, h - 1, h).repeat(w, 1).t().repeat(batch * num_anchors, 1, 1).view(cls_anchor_dim).to(
-        device)
-    ix = torch.LongTensor(range(0, 2)).to(device)
-    anchor_w = anchors.view(num_anchors, anchor_step).index_select(1, ix[0]).repeat(1, batch, h * w).view(
-        cls_anchor_dim)
-    anchor_h = anchors.view(num_anchors, anchor_step).index_select(1, ix[1]).repeat(1, batch, h * w).view(
-        cls_anchor_dim)
-
-    xs, ys = torch.sigmoid(output[0]) + grid_x, torch.sigmoid(output[1]) + grid_y
-    ws, hs = torch.exp(output[2]) * anchor_w.detach(), torch.exp(output[3]) * anchor_h.detach()
-    det_confs = torch.sigmoid(output[4])
+    # objectness first: only the anchors above `obj_thresh` (in any image of
+    # the batch) go through the rest of the decoding, in the same order. The
+    # sigmoids still run on whole rows, as cheap as they are, so that their
+    # values do not depend on which anchors are kept
+    det_confs, xs, ys = [torch.sigmoid(output[:, :, k].reshape(-1)).view(batch, -1) for k in (4, 0, 1)]
+    anchor_ids, cell_ids = torch.nonzero((det_confs > obj_thresh).view(batch, num_anchors, h * w).any(0), as_tuple=True)
+    positions = anchor_ids * (h * w) + cell_ids
+    det_confs, xs, ys = det_confs[:, positions], xs[:, positions], ys[:, positions]
+    # (5 + num_classes) x batch x anchors
+    output = output[:, anchor_ids, :, cell_ids].permute(2, 1, 0).contiguous()
 
     # by ysyun, dim=1 means input is 2D or even dimension else dim=0
-    cls_confs = torch.nn.Softmax(dim=1)(output[5:5 + num_classes].transpose(0, 1)).detach()
+    cls_confs = torch.nn.Softmax(dim=1)(output[5:5 + num_classes].view(num_classes, -1).transpose(0, 1))
     cls_max_confs, cls_max_ids = torch.max(cls_confs, 1)
-    cls_max_confs = cls_max_confs.view(-1)
-    cls_max_ids = cls_max_ids.view(-1).float()
-
-    # sz_hw = h*w
-    # sz_hwa = sz_hw*num_anchors
-    # det_confs = convert2cpu(det_confs)
-    # cls_max_confs = convert2cpu(cls_max_confs)
-    # cls_max_ids = convert2cpu_long(cls_max_ids)
-    # xs, ys = convert2cpu(xs), convert2cpu(ys)
-    # ws, hs = convert2cpu(ws), convert2cpu(hs)
+    cls_max_confs = cls_max_confs.view(batch, -1)
+    cls_max_ids = cls_max_ids.view(batch, -1).float()
+
+    # anchors whose best class is not in `class_ids` lose their objectness,
+    # and are dropped before their boxes are decoded
+    if class_ids is not None:
+        whitelisted = (cls_max_ids[:, :, None] == torch.as_tensor(class_ids, device=device).float()).any(2)
+        det_confs = det_confs * whitelisted.float()
+        keep = (det_confs > obj_thresh).any(0)
+        anchor_ids, cell_ids, output = anchor_ids[keep], cell_ids[keep], output[:, :, keep]
+        det_confs, xs, ys = det_confs[:, keep], xs[:, keep], ys[:, keep]
+        cls_max_confs, cls_max_ids = cls_max_confs[:, keep], cls_max_ids[:, keep]
+
+    grid_x = (cell_ids % w).float()
+    grid_y = (cell_ids.float() - grid_x) / w
+    anchors = anchors.view(num_anchors, anchor_step)
+    anchor_w, anchor_h = anchors[anchor_ids, 0], anchors[anchor_ids, 1]
+
+    xs, ys = xs + grid_x, ys + grid_y
+    ws, hs = torch.exp(output[2]) * anchor_w, torch.exp(output[3]) * anchor_h
 
     cls_confs = det_confs * cls_max_confs
 
@@ -225,7 +227,6 @@ def get_region_boxes(output, obj_thresh, num_classes, anchors, num_anchors, only
                                                                                                            1.), torch.clamp_max(
         ys + hs / 2., 1.)
     boxes = [x1, y1, x2, y2, det_confs, cls_confs, cls_max_ids]
-    boxes = list(map(lambda x: x.view(batch, -1), boxes))
     boxes = torch.stack(boxes, dim=2)
 
     # for b in range(batch):
@@ -254,7 +255,7 @@ def get_region_boxes(output, obj_thresh, num_classes, anchors, num_anchors, only
     return boxes
 
 
-# def get_all_boxes(output, conf_thresh, num_classes, only_objectness=1, validation=False, use_cuda=True):
+# def get_all_boxes(output, conf_thresh, num_classes, only_objectness=1, validation=False, use_cuda=True, class_ids=None):
 #     # total number of inputs (batch size)
 #     # first element (x) for first tuple (x, anchor_mask, num_anchor)
 #     tot = output[0]['x'].data.size(0)
@@ -47,8 +47,9 @@ class VideoTracker(object):
             warnings.warn("Running in cpu mode!")
 
         self.vdo = cv2.VideoCapture()
-        self.detector = build_detector(cfg, use_cuda=use_cuda)
-        self.deepsort = build_tracker(cfg, use_cuda=use_cuda)
+        # both take BGR frames from OpenCV and convert the resized images
+        self.detector = build_detector(cfg, use_cuda=use_cuda, bgr=True)
+        self.deepsort = build_tracker(cfg, use_cuda=use_cuda, bgr=True)
         self.class_names = self.detector.class_names
 
         # Configure output video and json
@@ -98,9 +99,8 @@ class VideoTracker(object):
 
     @tik_tok
     def detection(self, frame, frame_id):
-        im = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         # do detection
-        bbox_xywh, cls_conf, cls_ids = self.detector(im)
+        bbox_xywh, cls_conf, cls_ids = self.detector(frame)
         if bbox_xywh is not None:
             # select person class
             mask = cls_ids == 0
@@ -110,7 +110,7 @@ class VideoTracker(object):
             cls_conf = cls_conf[mask]
 
             # do tracking
-            outputs = self.deepsort.update(bbox_xywh, cls_conf, im)
+            outputs = self.deepsort.update(bbox_xywh, cls_conf, frame)
 
             # draw boxes for visualization
             if len(outputs) > 0:
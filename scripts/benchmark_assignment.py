@@ -0,0 +1,131 @@
+"""
+Benchmark the linear assignment solvers of deep_sort on random gated cost
+matrices and check that they agree with each other.
+
+    python scripts/benchmark_assignment.py --sizes 10 50 200 1000
+    python scripts/benchmark_assignment.py --layout spatial --sizes 1000 5000
+
+With `--layout uniform` every pair is feasible with probability `density`. With
+`--layout spatial`, tracks and detections are scattered over a plane and pairs
+closer than a radius are feasible (about `density` of all pairs), which is
+closer to gated wide-area footage.
+
+Every solver is timed on the same corpus, both on the full matrix and split
+into connected components (suffix `/cc`). Matches are compared against scipy:
+the exact solvers (lapjv, auto) must agree on every instance, greedy only on
+instances where no two feasible pairs share a track or a detection.
+"""
+import sys
+import time
+import argparse
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import numpy as np
+
+from deep_sort.sort import linear_assignment
+
+
+def uniform_cost(rng, n, m, density, max_distance):
+    cost = rng.uniform(0, max_distance, (n, m))
+    cost[rng.rand(n, m) > density] = linear_assignment.INFTY_COST
+    return cost
+
+
+def spatial_cost(rng, n, m, density, max_distance):
+    # Unit area per track, radius chosen such that about `density` of all
+    # pairs are feasible.
+    side = np.sqrt(n)
+    radius = np.sqrt(density * n / np.pi)
+    tracks = rng.uniform(0, side, (n, 2))
+    detections = rng.uniform(0, side, (m, 2))
+    k = min(n, m)
+    detections[:k] = tracks[:k] + rng.normal(0, 0.25 * radius, (k, 2))
+    distance = np.linalg.norm(tracks[:, None] - detections[None], axis=2)
+    cost = max_distance * distance / radius
+    cost[distance > radius] = linear_assignment.INFTY_COST
+    return cost
+
+
+def make_corpus(layout, sizes, densities, repeats, max_distance, seed=0):
+    rng = np.random.RandomState(seed)
+    make_cost = {"uniform": uniform_cost, "spatial": spatial_cost}[layout]
+    corpus = []
+    for n in sizes:
+        for density in densities:
+            for _ in range(repeats):
+                m = max(1, int(n * rng.uniform(0.8, 1.2)))
+                corpus.append(
+                    (n, density, make_cost(rng, n, m, density, max_distance)))
+    return corpus
+
+
+def gated_matches(cost_matrix, max_distance, solver):
+    solver, _, decompose = solver.partition("/")
+    cost_matrix = cost_matrix.copy()
+    cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
+    if decompose:
+        rows, cols = linear_assignment._solve_components(
+            cost_matrix, max_distance, linear_assignment.SOLVERS[solver])
+    else:
+        rows, cols = linear_assignment.solve(
+            cost_matrix, max_distance, solver, decompose=False)
+    is_match = cost_matrix[rows, cols] <= max_distance
+    return set(zip(rows[is_match].tolist(), cols[is_match].tolist()))
+
+
+def is_conflict_free(cost_matrix, max_distance):
+    feasible = cost_matrix <= max_distance
+    return (np.all(feasible.sum(axis=0) <= 1)
+            and np.all(feasible.sum(axis=1) <= 1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--layout", choices=["uniform", "spatial"],
+                        default="uniform")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10, 50, 200, 1000])
+    parser.add_argument("--densities", type=float, nargs="+",
+                        default=[0.002, 0.02, 0.2, 1.0])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--max_distance", type=float, default=0.2)
+    parser.add_argument("--solvers", nargs="+",
+                        default=sorted(linear_assignment.SOLVERS))
+    args = parser.parse_args()
+
+    solvers = [s for s in args.solvers
+               if s != "lapjv" or linear_assignment.lap is not None]
+    solvers += [s + "/cc" for s in solvers]
+    corpus = make_corpus(args.layout, args.sizes, args.densities,
+                         args.repeats, args.max_distance)
+
+    timings = {}
+    mismatches = {s: 0 for s in solvers}
+    for n, density, cost in corpus:
+        reference = gated_matches(cost, args.max_distance, "scipy")
+        conflict_free = is_conflict_free(cost, args.max_distance)
+        for solver in solvers:
+            start = time.perf_counter()
+            matches = gated_matches(cost, args.max_distance, solver)
+            elapsed = time.perf_counter() - start
+            timings.setdefault((n, density, solver), []).append(elapsed)
+            if solver.startswith("greedy") and not conflict_free:
+                continue
+            if matches != reference:
+                mismatches[solver] += 1
+
+    print("%6s %8s " % ("size", "density") +
+          " ".join("%10s" % s for s in solvers) + "   (ms)")
+    for n in args.sizes:
+        for density in args.densities:
+            print("%6d %8.3f " % (n, density) + " ".join(
+                "%10.3f" % (1e3 * np.median(timings[n, density, s]))
+                for s in solvers))
+    print("mismatches against scipy:", mismatches)
+    return 1 if any(mismatches.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Compare the vectorized non-maximum suppression of deep_sort against the
+previous implementation (a while loop around np.delete) on random boxes.
+
+    python scripts/benchmark_nms.py --sizes 10 100 500 2000
+
+Both versions must keep the same boxes in the same order.
+"""
+import sys
+import time
+import argparse
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import numpy as np
+
+from deep_sort.sort.preprocessing import non_max_suppression
+
+
+def legacy_non_max_suppression(boxes, max_bbox_overlap, scores=None):
+    if len(boxes) == 0:
+        return []
+
+    boxes = boxes.astype(np.float64)
+    pick = []
+
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 2] + boxes[:, 0]
+    y2 = boxes[:, 3] + boxes[:, 1]
+
+    area = (x2 - x1 + 1) * (y2 - y1 + 1)
+    if scores is not None:
+        idxs = np.argsort(scores)
+    else:
+        idxs = np.argsort(y2)
+
+    while len(idxs) > 0:
+        last = len(idxs) - 1
+        i = idxs[last]
+        pick.append(i)
+
+        xx1 = np.maximum(x1[i], x1[idxs[:last]])
+        yy1 = np.maximum(y1[i], y1[idxs[:last]])
+        xx2 = np.minimum(x2[i], x2[idxs[:last]])
+        yy2 = np.minimum(y2[i], y2[idxs[:last]])
+
+        w = np.maximum(0, xx2 - xx1 + 1)
+        h = np.maximum(0, yy2 - yy1 + 1)
+
+        overlap = (w * h) / area[idxs[:last]]
+
+        idxs = np.delete(
+            idxs, np.concatenate(
+                ([last], np.where(overlap > max_bbox_overlap)[0])))
+
+    return pick
+
+
+def random_boxes(rng, n, image_size=(1920, 1080)):
+    # Clusters of jittered boxes, as produced by a detector before NMS.
+    centers = rng.uniform(0, 1, (max(1, n // 4), 2)) * image_size
+    sizes = rng.uniform(20, 120, (len(centers), 2))
+    k = rng.randint(0, len(centers), n)
+    wh = sizes[k] * rng.uniform(0.9, 1.1, (n, 2))
+    tl = centers[k] + rng.normal(0, 0.1, (n, 2)) * wh - wh / 2
+    return np.c_[tl, wh], rng.uniform(0.3, 1, n)
+
+
+def timeit(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return 1e3 * np.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10, 50, 100, 500, 1000, 2000])
+    parser.add_argument("--overlap", type=float, default=0.5)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--torchvision", action="store_true",
+                        help="also time the torchvision.ops.nms path")
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    mismatches = 0
+    header = "%6s %10s %10s %10s" % ("boxes", "legacy", "new", "new@1.0")
+    if args.torchvision:
+        header += " %11s" % "torchvision"
+    print(header + "   (ms)")
+    for n in args.sizes:
+        boxes, scores = random_boxes(rng, n)
+        expected = legacy_non_max_suppression(boxes, args.overlap, scores)
+        if non_max_suppression(boxes, args.overlap, scores) != expected:
+            mismatches += 1
+        line = "%6d %10.3f %10.3f %10.3f" % (
+            n,
+            timeit(lambda: legacy_non_max_suppression(
+                boxes, args.overlap, scores), args.repeats),
+            timeit(lambda: non_max_suppression(
+                boxes, args.overlap, scores), args.repeats),
+            timeit(lambda: non_max_suppression(
+                boxes, 1.0, scores), args.repeats))
+        if args.torchvision:
+            line += " %11.3f" % timeit(lambda: non_max_suppression(
+                boxes, args.overlap, scores, use_torchvision=True),
+                args.repeats)
+        print(line)
+    print("mismatches against legacy:", mismatches)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Compare the YOLOv3 box decoding, which prunes anchors by objectness before
+decoding them, against the previous implementation (every anchor decoded,
+then filtered) on random network outputs at several input resolutions.
+
+    python scripts/benchmark_yolo_decode.py --sizes 320 416 608 832 1024
+
+Both versions must keep the same boxes, bit for bit and in the same order.
+"""
+import sys
+import time
+import argparse
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import numpy as np
+import torch
+
+from detector.YOLOv3.yolo_utils import get_region_boxes
+
+
+ANCHORS = [10, 13, 16, 30, 33, 23, 30, 61, 62, 45, 59, 119, 116, 90, 156, 198,
+           373, 326]
+
+
+def legacy_get_region_boxes(output, obj_thresh, num_classes, anchors,
+                            num_anchors):
+    anchor_step = anchors.size(0) // num_anchors
+    if output.dim() == 3:
+        output = output.unsqueeze(0)
+    batch = output.size(0)
+    h = output.size(2)
+    w = output.size(3)
+    cls_anchor_dim = batch * num_anchors * h * w
+
+    output = output.view(batch * num_anchors, 5 + num_classes, h * w).transpose(
+        0, 1).contiguous().view(5 + num_classes, cls_anchor_dim)
+
+    grid_x = torch.linspace(0, w - 1, w).repeat(
+        batch * num_anchors, h, 1).view(cls_anchor_dim)
+    grid_y = torch.linspace(0, h - 1, h).repeat(w, 1).t().repeat(
+        batch * num_anchors, 1, 1).view(cls_anchor_dim)
+    anchor_w = anchors.view(num_anchors, anchor_step)[:, 0:1].repeat(
+        1, batch, h * w).view(cls_anchor_dim)
+    anchor_h = anchors.view(num_anchors, anchor_step)[:, 1:2].repeat(
+        1, batch, h * w).view(cls_anchor_dim)
+
+    xs = torch.sigmoid(output[0]) + grid_x
+    ys = torch.sigmoid(output[1]) + grid_y
+    ws = torch.exp(output[2]) * anchor_w
+    hs = torch.exp(output[3]) * anchor_h
+    det_confs = torch.sigmoid(output[4])
+
+    cls_confs = torch.nn.Softmax(dim=1)(
+        output[5:5 + num_classes].transpose(0, 1))
+    cls_max_confs, cls_max_ids = torch.max(cls_confs, 1)
+    cls_max_ids = cls_max_ids.view(-1).float()
+
+    cls_confs = det_confs * cls_max_confs.view(-1)
+
+    xs, ys, ws, hs = xs / w, ys / h, ws / w, hs / h
+    x1 = torch.clamp_min(xs - ws / 2., 0.)
+    y1 = torch.clamp_min(ys - hs / 2., 0.)
+    x2 = torch.clamp_max(xs + ws / 2., 1.)
+    y2 = torch.clamp_max(ys + hs / 2., 1.)
+    boxes = [x1, y1, x2, y2, det_confs, cls_confs, cls_max_ids]
+    boxes = torch.stack([b.view(batch, -1) for b in boxes], dim=2)
+
+    # the previous post-processing kept only these
+    return boxes[:, (boxes[:, :, 4] > obj_thresh).any(0)]
+
+
+def random_outputs(rng, size, num_classes, objects):
+    # One output per YOLO layer, mostly background as on real frames.
+    outputs = []
+    for k, stride in enumerate((32, 16, 8)):
+        h = w = size // stride
+        x = rng.randn(1, 3, 5 + num_classes, h, w).astype(np.float32)
+        x[:, :, 4] -= 6
+        cells = rng.randint(0, h * w, objects)
+        x[0, rng.randint(0, 3, objects), 4, cells // w, cells % w] += 10
+        anchors = torch.FloatTensor(ANCHORS[(2 - k) * 6:(3 - k) * 6]) / stride
+        outputs.append((torch.from_numpy(x).view(1, -1, h, w), anchors))
+    return outputs
+
+
+def timeit(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return 1e3 * np.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[320, 416, 608, 832, 1024])
+    parser.add_argument("--obj_thresh", type=float, default=0.01)
+    parser.add_argument("--num_classes", type=int, default=80)
+    parser.add_argument("--objects", type=int, default=20,
+                        help="planted objects per YOLO layer")
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    mismatches = 0
+    print("%6s %8s %8s %10s %10s   (ms)" % (
+        "size", "anchors", "kept", "legacy", "new"))
+    for size in args.sizes:
+        outputs = random_outputs(rng, size, args.num_classes, args.objects)
+
+        def legacy():
+            return torch.cat([legacy_get_region_boxes(
+                x, args.obj_thresh, args.num_classes, a, 3)
+                for x, a in outputs], dim=1)
+
+        def new():
+            return torch.cat([get_region_boxes(
+                x, args.obj_thresh, args.num_classes, a, 3, use_cuda=False)
+                for x, a in outputs], dim=1)
+
+        with torch.no_grad():
+            expected = legacy()
+            if not torch.equal(new(), expected):
+                mismatches += 1
+            print("%6d %8d %8d %10.3f %10.3f" % (
+                size, sum(x.numel() for x, _ in outputs) // (
+                    5 + args.num_classes), expected.size(1),
+                timeit(legacy, args.repeats), timeit(new, args.repeats)))
+    print("mismatches against legacy:", mismatches)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
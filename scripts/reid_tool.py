@@ -0,0 +1,354 @@
+"""
+Checks and measurements for the ReID feature extractor of deep_sort.
+
+    python scripts/reid_tool.py parity --checkpoint deep_sort/deep/checkpoint/ckpt.t7
+    python scripts/reid_tool.py parity --random_weights --video demo/demo.avi
+
+`parity` compares the features of the RoIAlign extraction path against the
+OpenCV crop-and-resize path on the same boxes, and fails if the cosine
+similarity of any pair drops below `--min_cosine`. Boxes are random person
+sized boxes on frames of `--video`, or on synthetic frames if no video is
+given. With `--random_weights` a freshly initialized network is used, which
+is enough to bound the drift of the preprocessing when no trained checkpoint
+is at hand.
+
+    python scripts/reid_tool.py export --output reid.onnx
+    python scripts/reid_tool.py compare --backends torchscript onnx
+    python scripts/reid_tool.py benchmark --batch_sizes 1 8 32
+
+`export` writes the network to ONNX with a dynamic batch axis. `compare`
+checks the cosine similarity of the features of every backend against the
+eager model on a sample of crops.
+
+    python scripts/reid_tool.py quantize --crops data/crops
+    python scripts/reid_tool.py --quantized_checkpoint deep_sort/deep/checkpoint/ckpt_int8.t7 benchmark
+
+`quantize` fuses conv+bn+relu, calibrates the activation ranges of an INT8
+copy of the network on a folder of person crops and saves it next to the
+checkpoint, for REID_BACKEND "quantized". With `--quantized_checkpoint` the
+quantized backend takes part in `compare` and `benchmark`; `--random_weights`
+calibrates one on synthetic crops. deep_sort/deep/test.py --quantized and
+evaluate.py measure the top-1 and mAP change on Market1501.
+
+`benchmark` reports the cold start (model construction and checkpoint
+loading; for TorchScript and ONNX both the first run that compiles and
+caches the artifact and a later run that loads it) and the steady-state inference time
+of every backend, with the speedup over eager mode.
+
+    python scripts/reid_tool.py tune --batch_sizes 1 4 16 64
+
+`tune` measures the throughput of the extractor for every candidate
+`max_batch_size` on this machine and prints the size to put into
+DEEPSORT.REID_MAX_BATCH_SIZE.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import cv2
+import numpy as np
+import torch
+
+from deep_sort.deep.model import Net, quantize_net, save_quantized
+from deep_sort.deep import feature_extractor
+from deep_sort.deep.feature_extractor import Extractor, OnnxExtractor
+
+
+BACKENDS = list(Extractor.backends) + ["onnx"]
+
+
+def build_extractor(args, backend="eager", **kwargs):
+    if backend == "onnx":
+        return OnnxExtractor(args.checkpoint, use_cuda=args.use_cuda, **kwargs)
+    if backend == "quantized":
+        return Extractor(args.quantized_checkpoint, backend=backend, **kwargs)
+    return Extractor(args.checkpoint, use_cuda=args.use_cuda,
+                     backend=backend, **kwargs)
+
+
+def available_backends(args):
+    backends = BACKENDS
+    if feature_extractor.onnxruntime is None:
+        backends = [b for b in backends if b != "onnx"]
+    if not args.quantized_checkpoint:
+        backends = [b for b in backends if b != "quantized"]
+    return backends
+
+
+def load_crops(crops_dir, max_crops):
+    paths = sorted(
+        os.path.join(root, name) for root, _, names in os.walk(crops_dir)
+        for name in names
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")))
+    # the tracker embeds RGB crops
+    return [cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+            for path in paths[:max_crops]]
+
+
+def synthetic_crops(n):
+    rng = np.random.RandomState(0)
+    crops = []
+    for frame in load_frames(argparse.Namespace(video="", frames=1), rng):
+        boxes = random_boxes(rng, n, *frame.shape[:2])
+        crops += [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes]
+    return crops
+
+
+def quantize_checkpoint(checkpoint, crops, output, batch_size, qengine=None):
+    extractor = Extractor(checkpoint, use_cuda=False)
+    batches = (extractor._preprocess(crops[i:i + batch_size])
+               for i in range(0, len(crops), batch_size))
+    save_quantized(quantize_net(extractor.net, batches, qengine), output)
+    return output
+
+
+def load_frames(args, rng):
+    if args.video:
+        vdo = cv2.VideoCapture(args.video)
+        for _ in range(args.frames):
+            ok, frame = vdo.read()
+            if not ok:
+                break
+            yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return
+    for _ in range(args.frames):
+        frame = rng.randint(0, 256, (1080, 1920, 3)).astype(np.uint8)
+        yield cv2.GaussianBlur(frame, (15, 15), 5)
+
+
+def random_boxes(rng, n, height, width):
+    # integer x1, y1, x2, y2 boxes clamped to the frame, like DeepSort's
+    w = rng.uniform(0.02, 0.15, n) * width
+    h = w * rng.uniform(1.5, 3.5, n)
+    x = rng.uniform(0, width, n)
+    y = rng.uniform(0, height, n)
+    boxes = np.c_[x - w / 2, y - h / 2, x + w / 2, y + h / 2].astype(int)
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width - 1)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height - 1)
+    keep = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+    return boxes[keep]
+
+
+def timeit(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return 1e3 * np.median(times)
+
+
+def parity(args):
+    rng = np.random.RandomState(0)
+    extractor = build_extractor(args)
+    cosines = []
+    print("%6s %10s %10s %12s   (ms, preprocessing only)" % (
+        "boxes", "min cos", "cv2", "roi_align"))
+    for frame in load_frames(args, rng):
+        boxes = random_boxes(rng, args.boxes, *frame.shape[:2])
+        extractor.roi_align = False
+        expected = extractor.extract_boxes(frame, boxes)
+        extractor.roi_align = True
+        features = extractor.extract_boxes(frame, boxes)
+        cosine = np.sum(expected * features, axis=1)
+        cosines.append(cosine)
+
+        crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes]
+        print("%6d %10.6f %10.3f %12.3f" % (
+            len(boxes), cosine.min(),
+            timeit(lambda: extractor._preprocess(crops), args.repeats),
+            timeit(lambda: list(extractor._preprocess_boxes(frame, boxes)),
+                   args.repeats)))
+    cosines = np.concatenate(cosines)
+    print("cosine similarity: min %.6f mean %.6f" % (
+        cosines.min(), cosines.mean()))
+    return 0 if cosines.min() >= args.min_cosine else 1
+
+
+def tune(args):
+    extractor = build_extractor(args)
+    throughput = extractor.tune_max_batch_size(
+        args.batch_sizes, args.crops, args.repeats)
+    print("%10s %12s" % ("batch size", "crops/s"))
+    for batch_size, crops_per_second in sorted(throughput.items()):
+        print("%10d %12.1f" % (batch_size, crops_per_second))
+    print("REID_MAX_BATCH_SIZE:", extractor.max_batch_size)
+    return 0
+
+
+def benchmark(args):
+    rng = np.random.RandomState(0)
+    batches = {b: torch.from_numpy(rng.normal(size=(b, 3, 128, 64)).astype(
+        np.float32)) for b in args.batch_sizes}
+
+    def inference_time(extractor, batch):
+        batch = batch.to(extractor.device)
+        with torch.no_grad():
+            return timeit(lambda: extractor._run(batch), args.repeats)
+
+    results = {}
+    for backend in args.backends or available_backends(args):
+        start = time.perf_counter()
+        extractor = build_extractor(args, backend=backend)
+        load = [1e3 * (time.perf_counter() - start)]
+        if backend in ("torchscript", "onnx"):
+            start = time.perf_counter()
+            extractor = build_extractor(args, backend=backend)
+            load.append(1e3 * (time.perf_counter() - start))
+        results[backend] = (load, {b: inference_time(extractor, batch)
+                                   for b, batch in batches.items()})
+
+    eager_load, eager_times = results.get("eager", (None, None))
+    print("%-12s %10s %10s" % ("backend", "load", "cached") + "".join(
+        " %10s" % ("batch %d" % b) for b in args.batch_sizes) + "   (ms)")
+    for backend, (load, times) in results.items():
+        print("%-12s %10.1f %10s" % (
+            backend, load[0], "%.1f" % load[-1] if len(load) > 1 else "-")
+            + "".join(" %10.1f" % times[b] for b in args.batch_sizes))
+        if eager_times is not None and backend != "eager":
+            print("%-12s %10.2fx %9.2fx" % (
+                "  speedup", eager_load[0] / load[0],
+                eager_load[0] / load[-1]) + "".join(
+                " %9.2fx" % (eager_times[b] / times[b])
+                for b in args.batch_sizes))
+    return 0
+
+
+def export(args):
+    output = args.output or feature_extractor.artifact_path(
+        args.checkpoint, "onnx")
+    feature_extractor.export_onnx(args.checkpoint, output, args.opset)
+    print("exported", output)
+    return 0
+
+
+def compare(args):
+    rng = np.random.RandomState(0)
+    crops = []
+    for frame in load_frames(args, rng):
+        boxes = random_boxes(rng, args.boxes, *frame.shape[:2])
+        crops += [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes]
+    expected = build_extractor(args, backend=args.reference)(crops)
+    print("%d crops, cosine similarity against %s" % (
+        len(crops), args.reference))
+    worst = 1.
+    for backend in args.backends or available_backends(args):
+        if backend == args.reference:
+            continue
+        features = build_extractor(args, backend=backend)(crops)
+        cosine = np.sum(expected * features, axis=1)
+        worst = min(worst, cosine.min())
+        print("%-12s min %.6f mean %.6f" % (
+            backend, cosine.min(), cosine.mean()))
+    return 0 if worst >= args.min_cosine else 1
+
+
+def quantize(args):
+    crops = load_crops(args.crops, args.max_crops)
+    if not crops:
+        print("no crops found in", args.crops)
+        return 1
+    output = args.output or os.path.splitext(args.checkpoint)[0] + "_int8.t7"
+    quantize_checkpoint(args.checkpoint, crops, output, args.batch_size,
+                        args.qengine)
+    print("calibrated on %d crops, saved %s" % (len(crops), output))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--checkpoint",
+                        default="./deep_sort/deep/checkpoint/ckpt.t7")
+    parser.add_argument("--random_weights", action="store_true",
+                        help="use an untrained network instead of "
+                             "--checkpoint")
+    parser.add_argument("--quantized_checkpoint", default="",
+                        help="INT8 checkpoint for the quantized backend")
+    parser.add_argument("--cpu", dest="use_cuda", action="store_false")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_parity = subparsers.add_parser(
+        "parity", help="compare the RoIAlign and OpenCV extraction paths")
+    parser_parity.add_argument("--video", default="")
+    parser_parity.add_argument("--frames", type=int, default=5)
+    parser_parity.add_argument("--boxes", type=int, default=32)
+    parser_parity.add_argument("--repeats", type=int, default=10)
+    parser_parity.add_argument("--min_cosine", type=float, default=0.99)
+    parser_parity.set_defaults(func=parity)
+
+    parser_tune = subparsers.add_parser(
+        "tune", help="pick the max batch size with the best throughput")
+    parser_tune.add_argument("--batch_sizes", type=int, nargs="+",
+                             default=[1, 2, 4, 8, 16, 32, 64, 128])
+    parser_tune.add_argument("--crops", type=int, default=None,
+                             help="crops per measurement, defaults to the "
+                                  "largest batch size")
+    parser_tune.add_argument("--repeats", type=int, default=3)
+    parser_tune.set_defaults(func=tune)
+
+    parser_benchmark = subparsers.add_parser(
+        "benchmark", help="cold start and inference time of the backends")
+    parser_benchmark.add_argument("--backends", nargs="+", choices=BACKENDS,
+                                  help="defaults to all available")
+    parser_benchmark.add_argument("--batch_sizes", type=int, nargs="+",
+                                  default=[1, 8, 32])
+    parser_benchmark.add_argument("--repeats", type=int, default=10)
+    parser_benchmark.set_defaults(func=benchmark)
+
+    parser_export = subparsers.add_parser(
+        "export", help="export the checkpoint to ONNX")
+    parser_export.add_argument("--output", default="",
+                               help="defaults to the cached artifact next "
+                                    "to the checkpoint")
+    parser_export.add_argument("--opset", type=int, default=11,
+                               help="11 is the newest opset that the "
+                                    "pinned torch 1.4 can export")
+    parser_export.set_defaults(func=export)
+
+    parser_compare = subparsers.add_parser(
+        "compare", help="compare the features of the backends")
+    parser_compare.add_argument("--reference", default="eager",
+                                choices=BACKENDS)
+    parser_compare.add_argument("--backends", nargs="+", choices=BACKENDS,
+                                help="defaults to all available")
+    parser_compare.add_argument("--video", default="")
+    parser_compare.add_argument("--frames", type=int, default=2)
+    parser_compare.add_argument("--boxes", type=int, default=32)
+    parser_compare.add_argument("--min_cosine", type=float, default=0.9999)
+    parser_compare.set_defaults(func=compare)
+
+    parser_quantize = subparsers.add_parser(
+        "quantize", help="INT8 post-training quantization of the checkpoint")
+    parser_quantize.add_argument("--crops", required=True,
+                                 help="folder of person crops to calibrate "
+                                      "the activation ranges on")
+    parser_quantize.add_argument("--max_crops", type=int, default=1024)
+    parser_quantize.add_argument("--batch_size", type=int, default=32)
+    parser_quantize.add_argument("--qengine", choices=["fbgemm", "qnnpack"],
+                                 help="fbgemm on x86, qnnpack on ARM, "
+                                      "defaults to what torch supports")
+    parser_quantize.add_argument("--output", default="",
+                                 help="defaults to <checkpoint>_int8.t7")
+    parser_quantize.set_defaults(func=quantize)
+
+    args = parser.parse_args()
+    if not args.random_weights:
+        return args.func(args)
+    torch.manual_seed(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        args.checkpoint = os.path.join(tmp, "ckpt.t7")
+        torch.save({"net_dict": Net(reid=True).state_dict()}, args.checkpoint)
+        if not args.quantized_checkpoint and args.command != "quantize":
+            args.quantized_checkpoint = quantize_checkpoint(
+                args.checkpoint, synthetic_crops(64),
+                os.path.join(tmp, "ckpt_int8.t7"), batch_size=32)
+        return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
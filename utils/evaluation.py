@@ -4,6 +4,19 @@ import copy
 import motmetrics as mm
 mm.lap.default_solver = 'lap'
 from utils.io import read_results, unzip_objs
+from deep_sort.sort.iou_matching import iou_matrix
+
+
+def iou_distance_matrix(objs, hyps, max_iou=1.):
+    """
+    Drop-in replacement for motmetrics.distances.iou_matrix on top of the
+    tracker's vectorized IoU kernel: returns `1 - iou` between tlwh boxes,
+    with NaN where the distance exceeds `max_iou`.
+    """
+    if np.size(objs) == 0 or np.size(hyps) == 0:
+        return np.empty((0, 0))
+    C = 1. - iou_matrix(objs, hyps)
+    return np.where(C > max_iou, np.nan, C)
 
 
 class Evaluator(object):
@@ -42,7 +55,7 @@ class Evaluator(object):
 
         # remove ignored results
         keep = np.ones(len(trk_tlwhs), dtype=bool)
-        iou_distance = mm.distances.iou_matrix(ignore_tlwhs, trk_tlwhs, max_iou=0.5)
+        iou_distance = iou_distance_matrix(ignore_tlwhs, trk_tlwhs, max_iou=0.5)
         if len(iou_distance) > 0:
             match_is, match_js = mm.lap.linear_sum_assignment(iou_distance)
             match_is, match_js = map(lambda a: np.asarray(a, dtype=int), [match_is, match_js])
@@ -55,7 +68,7 @@ class Evaluator(object):
             trk_ids = trk_ids[keep]
 
         # get distance matrix
-        iou_distance = mm.distances.iou_matrix(gt_tlwhs, trk_tlwhs, max_iou=0.5)
+        iou_distance = iou_distance_matrix(gt_tlwhs, trk_tlwhs, max_iou=0.5)
 
         # acc
         self.acc.update(gt_ids, trk_ids, iou_distance)
@@ -37,8 +37,9 @@ class RealTimeTracking(object):
         if not use_cuda:
             warnings.warn(UserWarning("Running in cpu mode!"))
 
-        self.detector = build_detector(cfg, use_cuda=use_cuda)
-        self.deepsort = build_tracker(cfg, use_cuda=use_cuda)
+        # both take BGR frames from OpenCV and convert the resized images
+        self.detector = build_detector(cfg, use_cuda=use_cuda, bgr=True)
+        self.deepsort = build_tracker(cfg, use_cuda=use_cuda, bgr=True)
         self.class_names = self.detector.class_names
 
         self.vdo = cv2.VideoCapture(self.args.input)
@@ -71,9 +72,8 @@ class RealTimeTracking(object):
 
 
     def detection(self, frame):
-        im = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         # do detection
-        bbox_xywh, cls_conf, cls_ids = self.detector(im)
+        bbox_xywh, cls_conf, cls_ids = self.detector(frame)
         if bbox_xywh is not None:
             # select person class
             mask = cls_ids == 0
@@ -83,7 +83,7 @@ class RealTimeTracking(object):
             cls_conf = cls_conf[mask]
 
             # do tracking
-            outputs = self.deepsort.update(bbox_xywh, cls_conf, im)
+            outputs = self.deepsort.update(bbox_xywh, cls_conf, frame)
 
             # draw boxes for visualization
             if len(outputs) > 0: